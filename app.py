@@ -1,18 +1,22 @@
 # app.py
 # --- Imports ---
 import streamlit as st
-import fitz  # PyMuPDF
-import pandas as pd
+# fitz (PyMuPDF), PIL and pandas are imported lazily where first needed (Steps 0/3 and 5) to speed up first paint
 import logging
 import time
+import orjson # Fast JSON decoding of stored candidate fields
 import io  # Required for BytesIO with fitz
+import xxhash # Fast, process-stable PDF fingerprint for cache keys
 from datetime import datetime # For default job name
-import functools # Potentially useful for more complex cache invalidation if needed later
+import functools # lru_cache for timestamp formatting
+import threading # Background page-render prewarming
+from concurrent.futures import ThreadPoolExecutor, as_completed # Parallel AI processing (Step 4)
 
 # --- Project Modules ---
 try:
     import config
     from services import storage_service, ocr_service, assistants
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 except ImportError as e:
     st.error(f"🚨 Failed to import project modules: {e}.")
     st.stop()
@@ -52,21 +56,41 @@ def initialize_state():
         if key not in st.session_state: st.session_state[key] = value
     logger.debug("Session state checked/initialized.")
 
+# Per-upload state reset when a new PDF arrives in Step 0 (job history/selection is kept)
+UPLOAD_RESET_STATE = {
+    'pdf_document': None, 'total_pages': 0, 'current_page_index': 0, 'start_page_of_current_group': 1,
+    'resume_page_groups': [], 'splitting_started': False, 'splitting_complete': False,
+    'ocr_response_data': None, 'process_button_active': False, 'ocr_error': None,
+    'processing_in_progress': False, 'current_job_id': None,
+}
+
 def reset_app_state():
     """Resets the state for a new analysis."""
     logger.info("Resetting application state for new analysis.")
     # Preserve selected job ID maybe? Or clear everything. Let's clear all for full reset.
     keys_to_clear = list(st.session_state.keys())
     for key in keys_to_clear: del st.session_state[key]
-    # Clear all Streamlit cache data as well for a full reset
-    st.cache_data.clear()
-    logger.info("Cleared all session state and Streamlit cache.")
+    # DB-backed caches are invalidated where the data changes (create/delete), not here.
+    logger.info("Cleared all session state.")
     initialize_state() # Re-initialize with defaults
+    # Rendered pages are process-wide (shared by every session); max_entries evicts them, not a reset
 
 # Initialize state at the start
 initialize_state()
 
 # --- Helper Functions ---
+PREVIEW_WIDTH_PX = 400 # Display width of the Step 3 page preview
+
+def _render_preview_bytes(page):
+    """Rasterizes a fitz.Page at exactly the preview width and encodes it as JPEG."""
+    import fitz  # PyMuPDF
+    from PIL import Image
+    zoom = PREVIEW_WIDTH_PX / page.rect.width if page.rect.width else 1.0
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csRGB, alpha=False)
+    # Wrap the raw RGB samples without copying and let Pillow (libjpeg-turbo) encode them
+    buf = io.BytesIO()
+    Image.frombuffer("RGB", (pix.width, pix.height), pix.samples_mv, "raw", "RGB", pix.stride, 1).save(buf, format="JPEG", quality=75, optimize=False)
+    return buf.getvalue()
 
 # Non-cached rendering (Fallback)
 def render_page(pdf_document, page_index):
@@ -75,23 +99,86 @@ def render_page(pdf_document, page_index):
     if not pdf_document: return None
     try:
         if 0 <= page_index < len(pdf_document):
-            page=pdf_document.load_page(page_index); pix=page.get_pixmap(matrix=fitz.Matrix(1.7,1.7)); return pix.tobytes("png")
+            return _render_preview_bytes(pdf_document.load_page(page_index))
         else: logger.warning(f"render_page: Invalid index {page_index}"); return None
     except Exception as e: logger.error(f"Error rendering page {page_index}: {e}", exc_info=True); return None
 
+# Per-session document handle (parsed once per upload, reused by every page render in that session)
+def open_pdf_document(pdf_bytes_hash, pdf_bytes):
+    """Opens the PDF for the current session. Not shared: fitz.Document is not thread-safe and sessions render concurrently."""
+    import fitz  # PyMuPDF
+    logger.info(f"Opening PDF document for hash {pdf_bytes_hash}.")
+    return fitz.open(stream=io.BytesIO(pdf_bytes), filetype="pdf")
+
 # Cached rendering (Preferred)
-@st.cache_data(max_entries=50) # Cache images based on hash, bytes, index
-def render_page_cached(_pdf_doc_bytes_hash, _pdf_doc_bytes, page_index):
-    """Renders PDF page from bytes. Cached."""
-    # ... (Implementation unchanged from previous version) ...
-    logger.debug(f"Rendering page {page_index} (cache check for hash {_pdf_doc_bytes_hash})")
-    if not _pdf_doc_bytes: return None
-    try:
-        with fitz.open(stream=io.BytesIO(_pdf_doc_bytes), filetype="pdf") as pdf_doc:
-            if 0 <= page_index < len(pdf_doc):
-                page=pdf_doc.load_page(page_index); pix=page.get_pixmap(matrix=fitz.Matrix(1.7,1.7)); return pix.tobytes("png")
-            else: return None
-    except Exception as e: logger.error(f"Error rendering page {page_index} from cache: {e}", exc_info=True); return None
+RENDER_CACHE_ENTRIES = 200 # Small JPEG entries; also bounds how many pages are prewarmed
+@st.cache_data(max_entries=RENDER_CACHE_ENTRIES, show_spinner=False) # Keyed on content hash + index only; the document handle is not hashed
+def render_page_cached(pdf_hash, _pdf_document, page_index):
+    """Renders a page from the session's own fitz.Document (see open_pdf_document). Cached."""
+    logger.debug(f"Rendering page {page_index} (cache check for hash {pdf_hash})")
+    return render_page(_pdf_document, page_index)
+
+def _prewarm_page_renders(pdf_hash, pdf_bytes, total_pages):
+    """Fills render_page_cached for the first pages so Step 3 navigation hits the cache."""
+    import fitz  # PyMuPDF
+    # Private document: fitz.Document is not thread-safe, and the session's one is rendered from the script thread
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_document:
+        for page_index in range(min(total_pages, RENDER_CACHE_ENTRIES)): render_page_cached(pdf_hash, pdf_document, page_index)
+    logger.info(f"Prewarmed {min(total_pages, RENDER_CACHE_ENTRIES)} page previews for hash {pdf_hash}.")
+
+def start_prewarm_page_renders(pdf_hash, pdf_bytes, total_pages):
+    """Starts _prewarm_page_renders on a daemon thread (cache_data is process-wide, so reruns see it)."""
+    worker = threading.Thread(target=_prewarm_page_renders, args=(pdf_hash, pdf_bytes, total_pages), daemon=True, name="page-prewarm")
+    add_script_run_ctx(worker, get_script_run_ctx()); worker.start()
+
+@st.cache_resource
+def get_render_executor():
+    """Small process-wide pool for rendering neighbouring pages ahead of navigation."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="page-render")
+
+_render_worker_state = threading.local() # Each pool worker keeps its own document: fitz.Document is not thread-safe
+
+def _render_worker_document(pdf_hash, pdf_bytes):
+    """Returns this worker thread's private fitz.Document for pdf_hash, reopening it when the PDF changes."""
+    if getattr(_render_worker_state, "pdf_hash", None) != pdf_hash:
+        import fitz  # PyMuPDF
+        previous = getattr(_render_worker_state, "pdf_document", None)
+        if previous is not None: previous.close()
+        _render_worker_state.pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf"); _render_worker_state.pdf_hash = pdf_hash
+    return _render_worker_state.pdf_document
+
+def _render_page_in_background(pdf_hash, pdf_bytes, page_index):
+    # No script run context: pool threads outlive the run, and cache_data without a spinner does not need one
+    try: render_page_cached(pdf_hash, _render_worker_document(pdf_hash, pdf_bytes), page_index)
+    except Exception as e: logger.warning(f"Background render of page {page_index} failed: {e}")
+
+def prefetch_adjacent_pages(pdf_hash, pdf_bytes, page_index, total_pages):
+    """Queues renders of page_index +/- 1 so the next Prev/Next click is a cache hit."""
+    executor = get_render_executor()
+    for neighbour in (page_index + 1, page_index - 1):
+        if 0 <= neighbour < total_pages: executor.submit(_render_page_in_background, pdf_hash, pdf_bytes, neighbour)
+
+def flush_pending_candidates(pending_rows, status_container):
+    """Stores buffered Step 4 results in one transaction and empties the buffer. Returns (stored, failed)."""
+    if not pending_rows: return 0, 0
+    page_ranges = ", ".join(row[1] for row in pending_rows)
+    status_container.write(f"💾 Storing {len(pending_rows)} resumes (Pgs {page_ranges})...")
+    stored = storage_service.store_candidates_bulk(pending_rows); failed = len(pending_rows) - stored
+    if failed: status_container.warning(f"⚠️ DB store failed for {failed} resumes (Pgs {page_ranges}).")
+    pending_rows.clear(); return stored, failed
+
+# --- Cached OCR ---
+# Keyed on the stable content hash, so re-uploading the same PDF skips Mistral OCR entirely.
+# In-memory cache first, then the persistent SQLite ocr_cache table (survives restarts).
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def cached_perform_ocr(pdf_hash: int, pdf_name: str, _pdf_bytes: bytes, _page_count: int = 0):
+    db_key = f"{pdf_hash:016x}" # xxh3 digest is unsigned 64-bit; store as hex text
+    ocr_pages = storage_service.get_ocr_by_hash(db_key)
+    if ocr_pages is not None: return ocr_pages
+    logger.info(f"CACHE MISS: Running OCR for '{pdf_name}' (hash {db_key}).")
+    ocr_pages = ocr_service.perform_ocr(pdf_name, _pdf_bytes, page_count=_page_count)
+    if ocr_pages: storage_service.save_ocr(db_key, ocr_pages) # Only persist usable results
+    return ocr_pages
 
 # --- Cached Database Load Functions ---
 # These wrap the storage_service calls and apply Streamlit caching.
@@ -102,10 +189,105 @@ def cached_load_job_list():
 
 @st.cache_data(ttl=3600) # Cache candidates per job_id
 def cached_load_candidates_for_job(job_id: int):
-    if not job_id: return [] # Avoid caching a call with invalid ID
+    if not job_id: return {} # Avoid caching a call with invalid ID
     logger.info(f"CACHE MISS/RELOAD: Loading candidates for job ID {job_id} from database.")
     return storage_service.load_candidates_for_job(job_id)
 
+@functools.lru_cache(maxsize=4096) # created_at values never change, so hit rate is ~100% after first render
+def format_job_timestamp(created_at: str, short_year: bool = True) -> str:
+    """'YYYY-MM-DD HH:MM:SS' (SQLite CURRENT_TIMESTAMP) -> 'yy-mm-dd HH:MM' (or 'YYYY-MM-DD HH:MM'), without strptime."""
+    return created_at[2 if short_year else 0:16].replace('T',' ')
+
+# Job selector labels ("name (yy-mm-dd HH:MM)")
+@st.cache_data(ttl=3600)
+def build_job_options(jobs_tuple):
+    return {job_id: f"{job_name} ({format_job_timestamp(created_at)})" for job_id, job_name, created_at in jobs_tuple}
+
+# --- Results Table Helpers (Step 5) ---
+DISPLAY_COLUMNS = {
+    'id': 'ID', 'candidate_name': 'Name','email': 'Email', 'resume_page_range': 'Pages',
+    'score_percent': 'Fit Score (%)', 'overall_score_percent': 'Overall Score (%)',
+    'total_years_experience': 'Exp (Yrs)', 'total_internship_duration': 'Internships',
+    'matched_skills': 'Matched Skills', 'missing_skills': 'Missing Skills',
+    'score_reasoning': 'Reasoning (Fit)', 'processing_timestamp': 'Processed At'
+}
+
+SEARCH_COLUMN = '_search' # Helper column; not part of DISPLAY_COLUMNS, so never shown or exported
+RESULT_DTYPES = { # Text columns as pandas 'string' so searches need no astype(str)
+    'id': 'Int64', 'candidate_name': 'string', 'email': 'string', 'resume_page_range': 'string',
+    'total_internship_duration': 'string', 'score_reasoning': 'string'
+}
+
+LIST_COLUMNS = ['Matched Skills', 'Missing Skills'] # Decoded from JSON arrays; shown via ListColumn
+
+def safe_json_loads(json_string, default_value):
+    """Parses a JSON string, returning default_value for None/non-string/malformed input."""
+    if not isinstance(json_string, str) or not json_string: return default_value
+    try: return orjson.loads(json_string)
+    except orjson.JSONDecodeError: return default_value
+
+def _as_string_list(value):
+    """Normalizes a decoded skills value to a list of strings (anything else -> [])."""
+    return [str(item) for item in value] if isinstance(value, list) else []
+
+def build_display_df(results_data):
+    """Builds the renamed, formatted results table from column-oriented candidate data."""
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    n_rows = len(next(iter(results_data.values()), []))
+    def column(key): return results_data.get(key) or [None] * n_rows # Missing column -> all-NA
+
+    # Finish every column as an array first, then construct the DataFrame once in display order
+    columns = {DISPLAY_COLUMNS[key]: pd.array(column(key), dtype=dtype) for key, dtype in RESULT_DTYPES.items()}
+    # The loader CASTs scores to INTEGER-or-NULL, so one fromiter pass yields the int32 column (missing -> -1)
+    for key in ('score_percent', 'overall_score_percent'):
+        columns[DISPLAY_COLUMNS[key]] = np.fromiter((-1 if score is None else score for score in column(key)), dtype=np.int32, count=n_rows)
+    columns['Exp (Yrs)'] = np.nan_to_num(pd.to_numeric(column('total_years_experience'), errors='coerce'), nan=0).round(1)
+    # Decode the JSON skill arrays once per cell, straight into Arrow list<string> columns (offset-backed, no Python lists)
+    skills_dtype = pd.ArrowDtype(pa.list_(pa.string()))
+    for key in ('matched_skills', 'missing_skills'):
+        columns[DISPLAY_COLUMNS[key]] = pd.array([_as_string_list(safe_json_loads(value, [])) for value in column(key)], dtype=skills_dtype)
+    columns['Processed At'] = pd.to_datetime(column('processing_timestamp'), errors='coerce', format='ISO8601').strftime('%Y-%m-%d %H:%M').fillna('Invalid Date') # ISO8601: older rows carry microseconds, newer ones don't
+    # One lowercase haystack per row so the text filter is a single literal substring scan (hidden from table/CSV)
+    columns[SEARCH_COLUMN] = [f"{name or ''}|{email or ''}".lower() for name, email in zip(column('candidate_name'), column('email'))]
+    return pd.DataFrame(columns, columns=[*DISPLAY_COLUMNS.values(), SEARCH_COLUMN])
+
+def filter_display_df(display_df, min_fit_score, min_exp_years, search_term):
+    """Applies the Step 5 score/experience/text filters."""
+    filtered_df = display_df[(display_df['Fit Score (%)'] >= min_fit_score) & (display_df['Exp (Yrs)'] >= min_exp_years)]
+    if search_term:
+        filtered_df = filtered_df[filtered_df[SEARCH_COLUMN].str.contains(search_term.lower(), regex=False, na=False)]
+    return filtered_df
+
+@st.cache_data(ttl=3600, show_spinner=False) # Per job: reruns skip JSON decoding and column building entirely
+def build_results_df(job_id: int):
+    """Finished Step 5 table for a job, or None when it has no candidates."""
+    results_data = cached_load_candidates_for_job(job_id)
+    return build_display_df(results_data) if results_data else None
+
+def clear_job_results_caches(job_id: int):
+    """Invalidates every cache derived from a job's candidate rows."""
+    cached_load_candidates_for_job.clear(job_id=job_id); build_results_df.clear(job_id=job_id)
+    prepare_results_csv.clear(); exp_slider_max.clear()
+
+@st.cache_data(ttl=3600, show_spinner=False) # Frozen per job: skips an O(N) max() on every widget rerun
+def exp_slider_max(job_id: int, _display_df) -> int:
+    return int(_display_df['Exp (Yrs)'].max()) + 1
+
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False) # Scalar args -> O(1) key; in memory only (CSV holds candidate PII)
+def prepare_results_csv(job_id: int, max_candidate_id: int, min_fit_score: int, min_exp_years: int, search_term: str) -> bytes:
+    """Filtered results as CSV. max_candidate_id versions the key, so rows added to a job never serve a stale cached CSV."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    filtered_df = filter_display_df(build_results_df(job_id), min_fit_score, min_exp_years, search_term)
+    table = pa.Table.from_pandas(filtered_df[list(DISPLAY_COLUMNS.values())], preserve_index=False)
+    # Join list<string> cells and serialize entirely in Arrow's C kernels (no per-row Python joins, no pandas to_csv)
+    for col in LIST_COLUMNS: table = table.set_column(table.schema.get_field_index(col), col, pc.fill_null(pc.binary_join(table[col], '; '), ''))
+    sink = pa.BufferOutputStream(); pacsv.write_csv(table, sink)
+    return sink.getvalue().to_pybytes()
+
 # --- ==================== UI Rendering Based on Step ==================== ---
 st.title("📄✨ AI Resume Analyzer")
 st.markdown("""
@@ -123,15 +305,15 @@ if st.sidebar.button("🔄 Clear Cache & Reload Data", help="Force reload data f
 st.sidebar.markdown("---")
 # --- Reset Button ---
 if st.session_state.current_step > 0:
-     if st.sidebar.button("🆕 Start New Analysis (Reset All)", help="Clears state and cache."):
-          reset_app_state(); st.rerun() # reset_app_state now includes cache clear
+     if st.sidebar.button("🆕 Start New Analysis (Reset All)", help="Clears the current analysis state."):
+          reset_app_state(); st.rerun()
 st.sidebar.markdown("---")
 st.sidebar.header("Current Status")
 step_map = {0:"1. PDF",1:"2. JD",2:"3. Split",3:"4. Ready",4:"4. AI Processing",5:"5. Results"}; st.sidebar.metric("Current Step", step_map.get(st.session_state.current_step,"?"))
 # --- Moved Job List Loading and Options Definition Here ---
 try:
     job_list = cached_load_job_list()
-    job_options = {job['job_id']: f"{job['job_name']} ({datetime.strptime(job['created_at'][:19], '%Y-%m-%d %H:%M:%S').strftime('%y-%m-%d %H:%M')})" for job in job_list}
+    job_options = build_job_options(tuple((job['job_id'], job['job_name'], job['created_at']) for job in job_list))
 except Exception as e:
     logger.error(f"Failed to load job list for UI: {e}", exc_info=True)
     job_list = []
@@ -158,20 +340,16 @@ if st.session_state.current_step == 0:
 
     if uploaded_pdf is not None:
         pdf_bytes = uploaded_pdf.getvalue()
-        current_pdf_hash = hash(pdf_bytes)
+        current_pdf_hash = xxhash.xxh3_64_intdigest(pdf_bytes)
         if current_pdf_hash != st.session_state.pdf_bytes_hash:
             logger.info(f"New PDF uploaded: {uploaded_pdf.name}. Resetting state and triggering OCR.")
             # --- Reset state, store bytes and name ---
-            st.session_state.pdf_document = None; st.session_state.total_pages = 0; st.session_state.current_page_index = 0
-            st.session_state.start_page_of_current_group = 1; st.session_state.resume_page_groups = []; st.session_state.splitting_started = False
-            st.session_state.splitting_complete = False; st.session_state.ocr_response_data = None; st.session_state.process_button_active = False
-            st.session_state.ocr_error = None; st.session_state.ocr_in_progress = True; st.session_state.processing_in_progress = False
-            st.session_state.pdf_bytes_hash = current_pdf_hash; st.session_state.current_job_id = None
-            st.session_state.uploaded_pdf_name = uploaded_pdf.name; st.session_state.pdf_bytes = pdf_bytes # Store bytes
+            st.session_state.update(UPLOAD_RESET_STATE)
+            st.session_state.update({'pdf_bytes_hash': current_pdf_hash, 'pdf_bytes': pdf_bytes, 'uploaded_pdf_name': uploaded_pdf.name, 'ocr_in_progress': True})
 
             # --- Load PDF ---
             try:
-                st.session_state.pdf_document = fitz.open(stream=io.BytesIO(pdf_bytes), filetype="pdf")
+                st.session_state.pdf_document = open_pdf_document(current_pdf_hash, pdf_bytes) # This session's handle; the preview renderer uses it
                 st.session_state.total_pages = len(st.session_state.pdf_document)
                 logger.info(f"PDF loaded: {st.session_state.total_pages} pages.")
             except Exception as pdf_err:
@@ -181,12 +359,17 @@ if st.session_state.current_step == 0:
 
             # --- Trigger OCR ---
             if st.session_state.pdf_document and st.session_state.total_pages > 0:
-                ocr_status_placeholder = st.empty(); ocr_status_placeholder.info("⚙️ Performing OCR...")
-                with st.spinner("Processing PDF text..."): ocr_result = ocr_service.perform_ocr(uploaded_pdf.name, pdf_bytes)
+                chunked = st.session_state.total_pages > config.OCR_PAGES_PER_CHUNK
+                with st.status(f"⚙️ Performing OCR on {st.session_state.total_pages} pages" + (f" (parallel chunks of {config.OCR_PAGES_PER_CHUNK})..." if chunked else "..."), expanded=False) as ocr_status:
+                    ocr_result = cached_perform_ocr(current_pdf_hash, uploaded_pdf.name, pdf_bytes, st.session_state.total_pages)
+                    ocr_status.update(label="✅ OCR finished." if ocr_result else "❌ OCR did not return text.", state="complete" if ocr_result else "error")
+                if ocr_result is None: cached_perform_ocr.clear(current_pdf_hash, uploaded_pdf.name) # Don't cache failures
                 if ocr_result is not None:
                     st.session_state.ocr_response_data = ocr_result
                     msg = f"✅ OCR Done ({len(ocr_result)} pages)." if ocr_result else "⚠️ OCR Done, no text found."
-                    if ocr_result: st.session_state.current_step = 1; st.session_state.ocr_error = None; logger.info(msg)
+                    if ocr_result:
+                        st.session_state.current_step = 1; st.session_state.ocr_error = None; logger.info(msg)
+                        start_prewarm_page_renders(current_pdf_hash, pdf_bytes, st.session_state.total_pages) # Warm previews while the user writes the JD
                     else: st.session_state.ocr_error = "No text content extracted."; logger.warning(msg)
                     st.rerun() # Go to Step 1 or show error on rerun
                 else:
@@ -219,14 +402,16 @@ elif st.session_state.current_step == 2:
     current_page_num = st.session_state.current_page_index + 1
     st.write(f"**Reviewing Page: {current_page_num} / {st.session_state.total_pages}** (Group starts page {st.session_state.start_page_of_current_group})")
 
-    # --- Display page image (using cache and stored bytes) ---
-    page_image_bytes = None; pdf_bytes_for_render = st.session_state.get('pdf_bytes')
-    if pdf_bytes_for_render and st.session_state.pdf_bytes_hash:
-        page_image_bytes = render_page_cached(st.session_state.pdf_bytes_hash, pdf_bytes_for_render, st.session_state.current_page_index)
-    if not page_image_bytes and st.session_state.pdf_document: # Fallback
-        page_image_bytes = render_page(st.session_state.pdf_document, st.session_state.current_page_index)
-    if page_image_bytes: st.image(page_image_bytes, use_container_width=False, width=400)
+    # --- Display page image (cached per content hash, rendered from the session's document) ---
+    page_image_bytes = None; pdf_document = st.session_state.pdf_document; pdf_hash = st.session_state.pdf_bytes_hash
+    if pdf_document and pdf_hash:
+        page_image_bytes = render_page_cached(pdf_hash, pdf_document, st.session_state.current_page_index)
+    elif pdf_document: # Fallback
+        page_image_bytes = render_page(pdf_document, st.session_state.current_page_index)
+    if page_image_bytes: st.image(page_image_bytes, use_container_width=False, width=PREVIEW_WIDTH_PX)
     else: st.warning("Could not render page preview.")
+    if pdf_hash and st.session_state.pdf_bytes:
+        prefetch_adjacent_pages(pdf_hash, st.session_state.pdf_bytes, st.session_state.current_page_index, st.session_state.total_pages)
 
     # --- Action Buttons ---
     st.markdown("---"); nav_cols = st.columns([1, 1, 2, 1])
@@ -263,6 +448,7 @@ elif st.session_state.current_step == 3:
                 logger.info(f"Attempting job create/retrieve for '{job_name}'...")
                 job_desc_snippet=(st.session_state.job_description[:100]+'...'); pdf_file=st.session_state.uploaded_pdf_name or "N/A"
                 current_job_id = storage_service.create_job(job_name, pdf_file, job_desc_snippet)
+                cached_load_job_list.clear() # New job row -> job list is stale
                 if current_job_id is None: st.error(f"❌ Failed start job '{job_name}'. Name taken or DB error?"); logger.error(f"Failed get job_id for '{job_name}'.")
                 else:
                     st.session_state.current_job_id=current_job_id; st.session_state.processing_log=[]; st.session_state.current_step=4
@@ -272,29 +458,43 @@ elif st.session_state.current_step == 3:
 elif st.session_state.current_step == 4:
     st.header("Step 4: Processing Resumes with AI...")
     st.info(f"🤖 Processing Job '{st.session_state.job_name_input}' (ID: {st.session_state.current_job_id})...")
-    total_resumes=len(st.session_state.resume_page_groups); progress_bar=st.progress(0,text="Initializing..."); status_container=st.container(); processed_count=0; error_count=0
+    total_resumes=len(st.session_state.resume_page_groups); progress_bar=st.progress(0,text="Initializing..."); status_container=st.container(); processed_count=0; error_count=0; pending_rows=[]
     try:
-        for i, page_group in enumerate(st.session_state.resume_page_groups):
-            # ... (Progress bar, status updates, Call assistants.process_single_resume_group) ...
-            pg_rng=f"{page_group[0]}-{page_group[-1]}" if len(page_group)>1 else str(page_group[0]); prog_txt=f"Resume {i+1}/{total_resumes} (Pgs {pg_rng})..."
-            curr_prog=(i+0.1)/total_resumes; progress_bar.progress(min(curr_prog,1.0),text=prog_txt); status_container.info(f"🔄 {prog_txt}")
-            extracted, scored, raw1, raw2 = assistants.process_single_resume_group(page_group, st.session_state.ocr_response_data, st.session_state.job_description)
-            progress_bar.progress(min(curr_prog+0.8/total_resumes,1.0), text=f"AI done for {pg_rng}...")
-            # ... (Store results using storage_service.store_candidate_data) ...
-            if extracted:
-                status_container.write(f"💾 Storing {pg_rng}..."); row_id=storage_service.store_candidate_data(st.session_state.current_job_id,pg_rng,st.session_state.job_description,extracted,scored,raw1,raw2)
-                if row_id: processed_count+=1
-                else: error_count+=1; status_container.warning(f"⚠️ DB store failed {pg_rng}.")
-            else: error_count+=1; status_container.warning(f"⚠️ Extract failed {pg_rng}, not stored.")
-            progress_bar.progress(min((i+1)/total_resumes,1.0), text=f"Done {pg_rng}.")
+        # Resume groups are independent and network-bound, so overlap their assistant calls.
+        # Workers only receive plain values; all Streamlit/DB writes stay on this thread.
+        ocr_data=st.session_state.ocr_response_data; job_desc=st.session_state.job_description
+        assistants.prefetch_assistant_profiles() # One retrieve per assistant here, not one per racing worker
+        progress_bar.progress(0.0, text=f"Submitting {total_resumes} resumes ({config.MAX_AI_WORKERS} at a time)...")
+        # Each task is a batch of groups sharing one scorer call (a batch of 1 when SCORER_BATCH_SIZE is 1)
+        groups=st.session_state.resume_page_groups; batch_size=max(1, config.SCORER_BATCH_SIZE); done=0
+        with ThreadPoolExecutor(max_workers=config.MAX_AI_WORKERS) as executor:
+            futures = {executor.submit(assistants.process_resume_batch, groups[i:i+batch_size], ocr_data, job_desc): groups[i:i+batch_size] for i in range(0, total_resumes, batch_size)}
+            for future in as_completed(futures):
+                batch=futures[future]
+                try: batch_results = future.result()
+                except Exception as e: logger.error(f"Worker failed for batch starting at page {batch[0][0]}: {e}", exc_info=True); batch_results = [(None, None, None, None)] * len(batch)
+                for page_group, (extracted, scored, raw1, raw2) in zip(batch, batch_results):
+                    done+=1; pg_rng=f"{page_group[0]}-{page_group[-1]}" if len(page_group)>1 else str(page_group[0])
+                    # Buffer results and store from the main thread in batches (one SQLite transaction each)
+                    if extracted:
+                        pending_rows.append((st.session_state.current_job_id,pg_rng,job_desc,extracted,scored,raw1,raw2))
+                        if len(pending_rows)>=config.DB_WRITE_BATCH_SIZE:
+                            stored, failed = flush_pending_candidates(pending_rows, status_container); processed_count+=stored; error_count+=failed
+                    else: error_count+=1; status_container.warning(f"⚠️ Extract failed {pg_rng}, not stored.")
+                progress_bar.progress(min(done/total_resumes,1.0), text=f"Done {pg_rng} ({done}/{total_resumes}).")
+        stored, failed = flush_pending_candidates(pending_rows, status_container); processed_count+=stored; error_count+=failed
         # --- Processing Finished ---
+        clear_job_results_caches(st.session_state.current_job_id) # Job may already have cached rows (reused name)
         final_msg = f"Job '{st.session_state.job_name_input}' finished.";
         if processed_count>0: st.success(f"✅ {final_msg} {processed_count} resumes stored.")
         if error_count>0: st.warning(f"⚠️ {final_msg} Issues with {error_count} resumes.")
         st.session_state.selected_job_id=st.session_state.current_job_id; st.session_state.current_step=5; st.session_state.processing_in_progress=False
         logger.info(f"Finished AI loop Job ID {st.session_state.current_job_id}. Stored:{processed_count}, Errors:{error_count}.")
         time.sleep(1.5); st.rerun()
-    except Exception as e: st.error(f"🚨 Critical error: {e}"); logger.error("Main loop exception.",exc_info=True); st.session_state.processing_in_progress=False; st.session_state.current_step=3; st.rerun()
+    except Exception as e:
+        st.error(f"🚨 Critical error: {e}"); logger.error("Main loop exception.",exc_info=True)
+        flush_pending_candidates(pending_rows, status_container) # Keep results that already came back
+        st.session_state.processing_in_progress=False; st.session_state.current_step=3; st.rerun()
 
 # --- Step 5: Show Results ---
 elif st.session_state.current_step == 5:
@@ -302,7 +502,7 @@ elif st.session_state.current_step == 5:
 
     # --- Job Selection & Deletion ---
     job_list = cached_load_job_list() # Use cached function
-    job_options = {job['job_id']: f"{job['job_name']} ({datetime.strptime(job['created_at'][:19], '%Y-%m-%d %H:%M:%S').strftime('%y-%m-%d %H:%M')})" for job in job_list}
+    job_options = build_job_options(tuple((job['job_id'], job['job_name'], job['created_at']) for job in job_list))
     default_job_id = st.session_state.get('selected_job_id')
     if default_job_id not in job_options and job_list: default_job_id = job_list[0]['job_id'] # Most recent
 
@@ -318,7 +518,7 @@ elif st.session_state.current_step == 5:
             st.session_state.selected_job_id = selected_job_id_from_ui; logger.info(f"User selected Job ID {st.session_state.selected_job_id}"); st.rerun()
 
     with col_detail: # Show details of selected job
-        if selected_job_details: st.caption(f"**PDF:** {selected_job_details.get('pdf_filename','N/A')} | **Created:** {datetime.strptime(selected_job_details['created_at'][:19],'%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')}")
+        if selected_job_details: st.caption(f"**PDF:** {selected_job_details.get('pdf_filename','N/A')} | **Created:** {format_job_timestamp(selected_job_details['created_at'], short_year=False)}")
         else: st.caption("Select a job.")
 
     with col_delete: # Delete button with popover confirmation
@@ -333,7 +533,7 @@ elif st.session_state.current_step == 5:
                     if deleted:
                         st.toast(f"Job ID {job_id_to_delete} deleted.")
                         # Clear caches
-                        cached_load_candidates_for_job.clear(job_id=job_id_to_delete) # Specific job cache
+                        clear_job_results_caches(job_id_to_delete) # Candidate rows + everything derived from them
                         cached_load_job_list.clear() # Job list cache
                         st.session_state.selected_job_id = None # Reset selection
                         st.rerun() # Reload job list and results area
@@ -344,60 +544,30 @@ elif st.session_state.current_step == 5:
     # --- Load and Display Results for Selected Job ---
     if st.session_state.selected_job_id:
         st.subheader(f"Candidates for: \"{job_options.get(st.session_state.selected_job_id, 'N/A')}\"")
-        # Load data specifically for the selected job using cached function
-        results_data = cached_load_candidates_for_job(st.session_state.selected_job_id)
+        # Load the finished table for the selected job (cached, so widget reruns don't rebuild it)
+        display_df = build_results_df(st.session_state.selected_job_id)
 
-        if results_data:
+        if display_df is not None:
             # --- Display Logic Starts Here ---
             try:
-                df = pd.DataFrame(results_data)
-
-                # Define Columns and Prepare DataFrame
-                display_columns = {
-                    'id': 'ID', 'candidate_name': 'Name','email': 'Email', 'resume_page_range': 'Pages',
-                    'score_percent': 'Fit Score (%)', 'overall_score_percent': 'Overall Score (%)',
-                    'total_years_experience': 'Exp (Yrs)', 'total_internship_duration': 'Internships',
-                    'matched_skills': 'Matched Skills', 'missing_skills': 'Missing Skills',
-                    'score_reasoning': 'Reasoning (Fit)', 'processing_timestamp': 'Processed At'
-                }
-                # Ensure columns exist
-                for col in display_columns.keys(): df[col] = df.get(col)
-                display_df = df[list(display_columns.keys())].copy()
-                display_df.rename(columns=display_columns, inplace=True)
-
-                # Formatting
-                if 'Processed At' in display_df.columns:
-                    try: display_df['Processed At'] = pd.to_datetime(display_df['Processed At']).dt.strftime('%Y-%m-%d %H:%M')
-                    except: display_df['Processed At'] = 'Invalid Date'
-                display_df['Fit Score (%)'] = pd.to_numeric(display_df['Fit Score (%)'], errors='coerce').fillna(-1).astype(int)
-                display_df['Overall Score (%)'] = pd.to_numeric(display_df['Overall Score (%)'], errors='coerce').fillna(-1).astype(int)
-                display_df['Exp (Yrs)'] = pd.to_numeric(display_df['Exp (Yrs)'], errors='coerce').fillna(0).round(1)
 
                 # Filtering UI
                 st.markdown("---"); st.markdown("#### Filter Results")
                 filter_cols = st.columns([1, 1, 2])
                 min_fit_score = filter_cols[0].slider("Min Fit Score:", -1, 100, -1, format="%d%%", key="sf", help="Filter by job fit score (-1 shows all).")
-                min_exp_years = filter_cols[1].slider("Min Exp (Yrs):", 0, int(display_df['Exp (Yrs)'].max()) + 1, 0, key="ef", help="Filter by minimum years of experience.")
+                min_exp_years = filter_cols[1].slider("Min Exp (Yrs):", 0, exp_slider_max(st.session_state.selected_job_id, display_df), 0, key="ef", help="Filter by minimum years of experience.")
                 search_term = filter_cols[2].text_input("Search Name/Email:", key="searchf", placeholder="Filter by text...")
 
-                # Apply Filters
-                filtered_df = display_df[
-                    (display_df['Fit Score (%)'] >= min_fit_score) &
-                    (display_df['Exp (Yrs)'] >= min_exp_years)
-                ]
-                if search_term:
-                    filtered_df = filtered_df[
-                        filtered_df['Name'].astype(str).str.contains(search_term, case=False, na=False) |
-                        filtered_df['Email'].astype(str).str.contains(search_term, case=False, na=False)
-                    ]
+                filtered_df = filter_display_df(display_df, min_fit_score, min_exp_years, search_term)
 
-                st.markdown(f"**Displaying {len(filtered_df)} of {len(results_data)} candidates for this job**")
+                st.markdown(f"**Displaying {len(filtered_df)} of {len(display_df)} candidates for this job**")
 
                 # Display Table with column configuration
                 st.dataframe(
                     filtered_df,
                     use_container_width=True,
                     hide_index=True,
+                    column_order=list(DISPLAY_COLUMNS.values()),
                     column_config={
                         "ID": st.column_config.NumberColumn(width="small"),
                         "Name": st.column_config.TextColumn(width="medium"),
@@ -421,19 +591,26 @@ elif st.session_state.current_step == 5:
                 )
 
                 # Download Button
-                @st.cache_data
-                def convert_df_to_csv(df_to_convert): return df_to_convert.to_csv(index=False).encode('utf-8')
-                csv_data = convert_df_to_csv(filtered_df)
+                csv_data = prepare_results_csv(st.session_state.selected_job_id, int(display_df['ID'].max()), min_fit_score, min_exp_years, search_term)
                 st.download_button(
                     label="📥 Download Filtered Results", data=csv_data,
                     file_name=f'job_{st.session_state.selected_job_id}_results_{time.strftime("%Y%m%d")}.csv',
                     mime='text/csv', help="Download the currently filtered table data."
                 )
+
+                # Raw AI output drill-down (fetched and decompressed only for the chosen candidate)
+                with st.expander("🔎 Raw AI Output"):
+                    raw_candidate_id = st.selectbox("Candidate ID:", filtered_df['ID'].dropna().astype(int).tolist(), index=None, key="raw_json_id", placeholder="Choose a candidate...")
+                    if raw_candidate_id is not None:
+                        raw_extract, raw_score = storage_service.get_raw_assistant_json(raw_candidate_id)
+                        raw_cols = st.columns(2)
+                        with raw_cols[0]: st.caption("Extraction (Assistant 1)"); st.code(raw_extract or "(none stored)", language="json")
+                        with raw_cols[1]: st.caption("Scoring (Assistant 2)"); st.code(raw_score or "(none stored)", language="json")
             # --- End Display Logic ---
             except Exception as display_err:
                 st.error(f"⚠️ Error occurred while displaying results: {display_err}")
                 logger.error("Results display encountered an error.", exc_info=True)
-        else: # If results_data is empty
+        else: # If the job has no candidates
             st.info(f"No candidates found in the database for the selected job (ID: {st.session_state.selected_job_id}).")
     else: # If no job is selected
         st.info("Select a processing job from the dropdown above to view results.")
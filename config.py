@@ -17,13 +17,26 @@ ASSISTANT_ID_SCORE = os.getenv("ASSISTANT_ID_SCORE")
 
 # Database Configuration
 DATABASE_NAME = "resumes.db" # Use relative path, stored in project root
+DB_WRITE_BATCH_SIZE = 8 # Step 4 results buffered per SQLite transaction
 
 # OCR Configuration
 OCR_MODEL = "mistral-ocr-latest"
 OCR_SIGNED_URL_EXPIRY_SECONDS = 600 # 10 minutes
+OCR_PAGES_PER_CHUNK = 8 # Larger PDFs are split and OCRed in parallel chunks of this many pages
+OCR_MAX_WORKERS = 4 # Concurrent OCR chunk requests
 
 # Assistant Configuration
 ASSISTANT_TIMEOUT_SECONDS = 180 # 3 minutes
+USE_ASSISTANTS_API = os.getenv("USE_ASSISTANTS_API", "false").lower() in ("1", "true", "yes") # Compatibility: threads/runs (needed only for Assistant tools/files); default is one chat.completions call per step
+MAX_AI_WORKERS = 4 # Resume groups processed concurrently in Step 4 (bounded by API rate limits)
+SCORER_BATCH_SIZE = 1 # Candidates scored per scorer call (>1 amortizes the JD prompt; 1 = one call per resume)
+EXTRACT_TOKEN_BUDGET = 100_000 # Estimated input tokens above which a resume group is extracted in halves
+
+# HTTP Client Configuration (shared by the OpenAI and Mistral clients)
+HTTP_MAX_CONNECTIONS = 32 # Pooled keep-alive connections per client; above MAX_AI_WORKERS/OCR_MAX_WORKERS
+HTTP_KEEPALIVE_SECONDS = 30 # Must exceed the assistant poll cap (5s) so idle polls reuse their TLS connection
+API_MAX_RETRIES = 4 # SDK-level retries (exponential backoff, honours Retry-After) for 429/5xx/timeouts/connection errors
+API_RETRY_MAX_ELAPSED_SECONDS = 60 # Mistral: give up retrying after this long
 
 # Validation (optional but recommended)
 def validate_config():
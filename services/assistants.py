@@ -1,8 +1,11 @@
 # services/assistants.py
 import logging
 import time
-import json
-from openai import OpenAI
+import orjson
+import io
+import functools
+import httpx
+from openai import OpenAI, DefaultHttpxClient
 from datetime import datetime # Import datetime
 
 # --- Project Modules ---
@@ -11,14 +14,16 @@ try:
 except ImportError:
     logging.error("Failed to import 'config' module. Ensure config.py exists.")
     # Define fallback defaults or raise error if config is critical
-    class MockConfig: MISTRAL_API_KEY=None; OPENAI_API_KEY=None; ASSISTANT_ID_EXTRACT=None; ASSISTANT_ID_SCORE=None; ASSISTANT_TIMEOUT_SECONDS=180
+    class MockConfig: MISTRAL_API_KEY=None; OPENAI_API_KEY=None; ASSISTANT_ID_EXTRACT=None; ASSISTANT_ID_SCORE=None; ASSISTANT_TIMEOUT_SECONDS=180; USE_ASSISTANTS_API=False
     config = MockConfig()
 
 # --- OpenAI Client Initialization ---
 openai_client = None
 if config.OPENAI_API_KEY:
     try:
-        openai_client = OpenAI(api_key=config.OPENAI_API_KEY)
+        # SDK-default client with a pool sized for the Step 4 workers; keep-alive outlives the run-poll interval
+        http_limits = httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS, max_keepalive_connections=config.HTTP_MAX_CONNECTIONS, keepalive_expiry=config.HTTP_KEEPALIVE_SECONDS)
+        openai_client = OpenAI(api_key=config.OPENAI_API_KEY, http_client=DefaultHttpxClient(limits=http_limits), max_retries=config.API_MAX_RETRIES)
         logging.info("OpenAI client initialized successfully.")
     except Exception as e:
         logging.error(f"Failed to initialize OpenAI client: {e}", exc_info=True)
@@ -38,7 +43,6 @@ def get_text_for_pages(ocr_markdowns: list[str], page_numbers: list[int]) -> str
     Returns:
         A single string containing the combined markdown for the requested pages.
     """
-    combined_text = []
     total_pages_available = len(ocr_markdowns)
 
     if total_pages_available == 0:
@@ -46,29 +50,39 @@ def get_text_for_pages(ocr_markdowns: list[str], page_numbers: list[int]) -> str
          return "--- Error: OCR data is empty ---"
 
     logging.debug(f"Aggregating text for page numbers {page_numbers} from {total_pages_available} available pages.")
-    for page_num in page_numbers:
+    if len(page_numbers) == 1: # Common single-page resume: one f-string, no buffer (missing/empty pages take the general path)
+        page_num = page_numbers[0]; page_content = ocr_markdowns[page_num - 1] if 0 < page_num <= total_pages_available else None
+        if page_content is not None and page_content.strip(): return f"--- Start Page {page_num} ---\n{page_content}\n--- End Page {page_num} ---"
+    # Write fences and page bodies straight into one buffer (no per-page f-string copies of the body, no join list)
+    buffer = io.StringIO()
+    for position, page_num in enumerate(page_numbers):
+        if position: buffer.write("\n\n")
         page_index = page_num - 1
         if 0 <= page_index < total_pages_available:
             page_content = ocr_markdowns[page_index]
             if page_content is not None and page_content.strip():
-                combined_text.append(f"--- Start Page {page_num} ---\n{page_content}\n--- End Page {page_num} ---")
+                buffer.write(f"--- Start Page {page_num} ---\n"); buffer.write(page_content); buffer.write(f"\n--- End Page {page_num} ---")
                 logging.debug(f"Added content from page {page_num} (index {page_index}).")
             else:
                 logging.warning(f"Markdown content for page {page_num} (index {page_index}) is empty/None.")
-                combined_text.append(f"--- Warning: Page {page_num} content is empty ---")
+                buffer.write(f"--- Warning: Page {page_num} content is empty ---")
         else:
             logging.warning(f"Requested page number {page_num} out of bounds ({total_pages_available} pages).")
-            combined_text.append(f"--- Error: Page {page_num} not found ---")
+            buffer.write(f"--- Error: Page {page_num} not found ---")
 
-    final_text = "\n\n".join(combined_text)
+    final_text = buffer.getvalue()
     logging.debug(f"Aggregated text length: {len(final_text)}")
     return final_text
 
 
 # --- Generic OpenAI Assistant Call Function ---
-def call_openai_assistant(assistant_id: str, prompt: str, thread_id: str = None) -> tuple[str | None, str | None]:
+ASSISTANT_POLL_INITIAL_SECONDS = 0.5 # First runs.retrieve delay, doubled per poll...
+ASSISTANT_POLL_MAX_SECONDS = 5.0 # ...up to this cap
+
+def call_openai_assistant(assistant_id: str, prompt: str, thread_id: str = None, additional_instructions: str | None = None) -> tuple[str | None, str | None]:
     """
     Runs a specific OpenAI assistant with a given prompt and optional thread ID.
+    additional_instructions (e.g. shared job context) is appended to the assistant's own instructions for this run.
     Returns the assistant's text response and the thread ID used.
     """
     if not openai_client: logging.error("OpenAI client unavailable."); return None, thread_id
@@ -86,16 +100,22 @@ def call_openai_assistant(assistant_id: str, prompt: str, thread_id: str = None)
             logging.info(f"Added message to existing OpenAI thread {thread_id}.")
 
         # Run Creation and Polling
-        run = openai_client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id)
+        run_kwargs = {"additional_instructions": additional_instructions} if additional_instructions else {}
+        try:
+            instructions = _get_assistant_profile(assistant_id)[1] # Fetched once per process; spares the run the server-side lookup
+            if instructions: run_kwargs["instructions"] = instructions
+        except Exception as e: logging.warning(f"No cached instructions for Assistant ID {assistant_id} ({e}); run uses its server-side ones.")
+        run = openai_client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant_id, **run_kwargs)
         logging.info(f"Started run {run.id} on thread {thread_id}.")
-        start_time = time.time()
+        start_time = time.time(); poll_delay = ASSISTANT_POLL_INITIAL_SECONDS
         while run.status in ['queued', 'in_progress', 'cancelling']:
             if time.time() - start_time > config.ASSISTANT_TIMEOUT_SECONDS:
                 logging.error(f"Run {run.id} timed out after {config.ASSISTANT_TIMEOUT_SECONDS}s.")
                 try: openai_client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run.id)
                 except Exception as ce: logging.error(f"Failed to cancel run {run.id}: {ce}")
                 return None, thread_id
-            time.sleep(2); run = openai_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+            time.sleep(poll_delay); poll_delay = min(poll_delay * 2, ASSISTANT_POLL_MAX_SECONDS) # Short runs finish fast; long ones poll less
+            run = openai_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
             logging.debug(f"Run {run.id} status: {run.status}")
 
         # Process Final Run Status
@@ -115,88 +135,156 @@ def call_openai_assistant(assistant_id: str, prompt: str, thread_id: str = None)
         return None, thread_id
 
 
-# --- Orchestration Function for the Two-Step Process ---
-def process_single_resume_group(page_group: list[int], ocr_data: list[str], job_description: str) -> tuple[dict | None, dict | None, str | None, str | None]:
+# --- Stateless Chat Completions Path (Default) ---
+@functools.lru_cache(maxsize=None) # One assistants.retrieve per assistant per process; failures raise, so they are not cached
+def _get_assistant_profile(assistant_id: str) -> tuple[str, str, dict]:
+    """Returns (model, instructions, sampling kwargs) configured on an Assistant."""
+    assistant = openai_client.beta.assistants.retrieve(assistant_id)
+    sampling = {k: v for k, v in (("temperature", assistant.temperature), ("top_p", assistant.top_p)) if v is not None}
+    if assistant.tools and not config.USE_ASSISTANTS_API: # Only model, instructions and sampling carry over; chat mode cannot use server-side tools or their files
+        logging.warning(f"Assistant ID {assistant_id} has tools ({', '.join(tool.type for tool in assistant.tools)}) that chat mode ignores; set USE_ASSISTANTS_API=true to use them.")
+    logging.info(f"Loaded profile for Assistant ID {assistant_id} (model: {assistant.model}).")
+    return assistant.model, assistant.instructions or "", sampling
+
+def prefetch_assistant_profiles() -> None:
+    """Loads the extractor/scorer profiles up front, so concurrent workers don't each miss the cache and retrieve them (both paths use them)."""
+    if not openai_client: return
+    for assistant_id in (config.ASSISTANT_ID_EXTRACT, config.ASSISTANT_ID_SCORE):
+        try: _get_assistant_profile(assistant_id)
+        except Exception as e: logging.warning(f"Could not prefetch profile for Assistant ID {assistant_id}: {e}") # Workers retry on demand
+
+def call_openai_chat(assistant_id: str, prompt: str, shared_context: str | None = None) -> str | None:
     """
-    Processes a single resume group: aggregates text, calls extraction (1)
-    and scoring (2) assistants, adding date context to scorer prompt.
+    Runs an Assistant's model + instructions as a single chat.completions call in JSON mode
+    (one HTTP round trip, no thread/run/poll/list). Returns the response text or None on error.
 
-    Returns:
-        Tuple: (extracted_data, scored_data, raw_json_extract, raw_json_score)
+    shared_context is sent as a second system message ahead of the prompt: content that is identical
+    across calls (instructions, then e.g. the job description) forms a stable prefix for OpenAI prompt caching.
     """
-    page_range_str = f"{page_group[0]}-{page_group[-1]}" if len(page_group) > 1 else str(page_group[0])
-    logging.info(f"--- Starting processing: Pages {page_range_str} ---")
+    if not openai_client: logging.error("OpenAI client unavailable."); return None
+    if not assistant_id: logging.error("Assistant ID required."); return None
+    if not prompt: logging.warning("Empty prompt provided."); return None
 
-    extracted_data = None; scored_data = None
-    raw_json_extract = None; raw_json_score = None
+    logging.info(f"Calling chat completions with profile of Assistant ID: {assistant_id}")
+    try:
+        model, instructions, sampling = _get_assistant_profile(assistant_id)
+        if "json" not in instructions.lower(): instructions += "\n\nRespond with a single JSON object." # JSON mode requires the word in the messages
+        messages = [{"role": "system", "content": instructions}]
+        if shared_context: messages.append({"role": "system", "content": shared_context})
+        messages.append({"role": "user", "content": prompt}) # Per-call content last, after the cacheable prefix
+        completion = openai_client.chat.completions.create(
+            model=model, messages=messages,
+            response_format={"type": "json_object"}, **sampling
+        )
+        choice = completion.choices[0]
+        if choice.finish_reason != "stop": logging.warning(f"Chat completion for {assistant_id} finished with '{choice.finish_reason}'.")
+        return choice.message.content
+    except Exception as e:
+        logging.error(f"Exception during OpenAI chat call (ID: {assistant_id}): {e}", exc_info=True)
+        return None
 
-    # == Step 1: Extraction using Assistant 1 ==
+def _run_assistant(assistant_id: str, prompt: str, shared_context: str | None = None) -> str | None:
+    """Dispatches to the chat.completions path (default), or the Assistants API when config.USE_ASSISTANTS_API is set."""
+    if config.USE_ASSISTANTS_API: return call_openai_assistant(assistant_id, prompt, additional_instructions=shared_context)[0]
+    return call_openai_chat(assistant_id, prompt, shared_context=shared_context)
+
+def _parse_llm_json(raw: str, label: str) -> dict | None:
+    """Parses an assistant reply into a JSON object, tolerating ``` / ```json fences. Returns None (logged) otherwise."""
+    json_str = raw.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    try: data = orjson.loads(json_str)
+    except orjson.JSONDecodeError as e: logging.error(f"Failed parsing {label}: {e}"); return None
+    if not isinstance(data, dict): logging.error(f"Failed parsing {label}: expected a JSON object, got {type(data).__name__}."); return None
+    return data
+
+def _run_assistant_json(assistant_id: str, prompt: str, label: str, shared_context: str | None = None) -> tuple[dict | None, str | None]:
+    """Runs an assistant and parses its reply once. Returns (parsed_object_or_None, raw_reply_or_None); raw is kept for storage."""
+    raw = _run_assistant(assistant_id, prompt, shared_context=shared_context)
+    return (_parse_llm_json(raw, label) if raw else None), raw
+
+
+# --- Orchestration Function for the Two-Step Process ---
+def _page_range_str(page_group: list[int]) -> str:
+    return f"{page_group[0]}-{page_group[-1]}" if len(page_group) > 1 else str(page_group[0])
+
+# Token estimate for oversized-input checks: exact with tiktoken when installed, else ~4 characters per token
+@functools.lru_cache(maxsize=1)
+def _token_encoding():
+    """Builds the tiktoken encoder on first use (construction is expensive and may download the encoding file)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e: logging.warning(f"tiktoken unavailable ({e}); estimating tokens from text length."); return None
+
+def _estimate_tokens(text: str) -> int:
+    encoding = _token_encoding()
+    return len(encoding.encode(text, disallowed_special=())) if encoding else len(text) // 4 + 1
+
+def _merge_extractions(first, second):
+    """Merges two partial extractions of one resume: dicts recursively, lists concatenated, first non-empty scalar wins."""
+    if isinstance(first, dict) and isinstance(second, dict):
+        return {key: _merge_extractions(first.get(key), second.get(key)) if key in first and key in second else first.get(key, second.get(key)) for key in {**first, **second}}
+    if isinstance(first, list) and isinstance(second, list): return first + second
+    return first if first not in (None, "", [], {}) else second
+
+def _extract_resume_group(page_group: list[int], ocr_data: list[str], page_range_str: str) -> tuple[dict | None, str | None]:
+    """Step 1: aggregates the group's text and runs the extractor. Returns (extracted_data, raw_json_extract)."""
+    extracted_data = None
     logging.info(f"Step 1/2: Calling Extractor ({config.ASSISTANT_ID_EXTRACT}) for {page_range_str}...")
     # 1a. Aggregate Text
     try:
         combined_text = get_text_for_pages(ocr_data, page_group)
         if not combined_text or "--- Error:" in combined_text:
             log_msg = f"Failed valid text aggregation for {page_range_str}."; logging.error(log_msg)
-            return None, None, f"Error: {log_msg}", None
+            return None, f"Error: {log_msg}"
     except Exception as e:
         logging.error(f"Exception aggregating text for {page_range_str}: {e}", exc_info=True)
-        return None, None, "Error: Exception during text aggregation", None
+        return None, "Error: Exception during text aggregation"
 
-    # 1b. Call Assistant 1
-    raw_json_extract, _ = call_openai_assistant(config.ASSISTANT_ID_EXTRACT, combined_text)
+    # 1b. Oversized groups would fail only after a full round trip: split them and merge the halves' extractions
+    estimated_tokens = _estimate_tokens(combined_text)
+    if estimated_tokens > config.EXTRACT_TOKEN_BUDGET:
+        if len(page_group) > 1:
+            logging.warning(f"~{estimated_tokens} tokens for {page_range_str} exceeds {config.EXTRACT_TOKEN_BUDGET}; extracting in two halves.")
+            half = len(page_group) // 2; halves = (page_group[:half], page_group[half:])
+            parts = [_extract_resume_group(part, ocr_data, _page_range_str(part)) for part in halves]
+            raw_json_extract = "\n\n".join(raw or "" for _, raw in parts)
+            if not all(data for data, _ in parts):
+                logging.error(f"Extraction failed for part of {page_range_str}. Skipping scoring."); return None, raw_json_extract
+            return _merge_extractions(parts[0][0], parts[1][0]), raw_json_extract
+        logging.warning(f"~{estimated_tokens} tokens for single page {page_range_str} exceeds {config.EXTRACT_TOKEN_BUDGET}; sending as is.")
 
-    # 1c. Parse Extraction Response
-    if raw_json_extract:
-        try:
-            logging.debug("Parsing extraction response...")
-            json_str = raw_json_extract.strip()
-            if json_str.startswith("```json"): json_str = json_str[7:]
-            if json_str.endswith("```"): json_str = json_str[:-3]
-            extracted_data = json.loads(json_str.strip())
-            logging.info(f"Parsed extracted data for {page_range_str}.")
-        except Exception as e:
-            logging.error(f"Failed parsing Extraction AI for {page_range_str}: {e}", exc_info=True)
-            extracted_data = None # Ensure failure
-    else:
+    # 1c. Call Assistant 1 and parse its response
+    extracted_data, raw_json_extract = _run_assistant_json(config.ASSISTANT_ID_EXTRACT, combined_text, f"Extraction AI for {page_range_str}")
+    if extracted_data: logging.info(f"Parsed extracted data for {page_range_str}.")
+    elif not raw_json_extract:
         logging.warning(f"No response from Extraction AI for {page_range_str}.")
         raw_json_extract = "Error: No response from Extraction AI"
 
-    if not extracted_data:
-        logging.error(f"Extraction failed/unparsed for {page_range_str}. Skipping scoring.")
-        return None, None, raw_json_extract, None
+    if not extracted_data: logging.error(f"Extraction failed/unparsed for {page_range_str}. Skipping scoring.")
+    return extracted_data, raw_json_extract
 
-    # == Step 2: Scoring using Assistant 2 ==
-    logging.info(f"Step 2/2: Calling Scorer ({config.ASSISTANT_ID_SCORE}) for {page_range_str}...")
-    # 2a. Get current date and prepare prompt
+def _build_scoring_context(job_description: str) -> str:
+    """Scorer context shared by every resume in a job (JD + current date)."""
     current_date_str = datetime.now().strftime('%d/%m/%Y')
     logging.info(f"Adding current date to scorer prompt: {current_date_str}")
-    
-    prompt_for_scorer = f"""
-    Current Date: {current_date_str}. 
+    # JD + date are the same for every resume in the job, so they go first (cacheable prefix); only the candidate varies
+    return f"Job Description: ```\n{job_description}\n```\nCurrent Date: {current_date_str}."
 
-    Candidate Data: ```json\n{json.dumps(extracted_data, indent=2)}\n```
-    Job Description: ```\n{job_description}\n```
-    """
-
-    # 2b. Call Assistant 2
-    raw_json_score, _ = call_openai_assistant(config.ASSISTANT_ID_SCORE, prompt_for_scorer)
+def _score_extracted(extracted_data: dict, scoring_context: str, page_range_str: str) -> tuple[dict, str]:
+    """Step 2: scores one extracted candidate. Returns (scored_data, raw_json_score); placeholder on failure."""
+    scored_data = None
+    logging.info(f"Step 2/2: Calling Scorer ({config.ASSISTANT_ID_SCORE}) for {page_range_str}...")
+    # 2a. Prepare prompt (JD + date arrive via scoring_context)
+    prompt_for_scorer = f"Candidate Data: ```json\n{orjson.dumps(extracted_data).decode()}\n```" # Compact: indentation only costs tokens
 
-    # 2c. Parse Scoring Response
-    if raw_json_score:
-        try:
-            logging.debug("Parsing scoring response...")
-            json_str = raw_json_score.strip()
-            if json_str.startswith("```json"): json_str = json_str[7:]
-            if json_str.endswith("```"): json_str = json_str[:-3]
-            scored_data = json.loads(json_str.strip())
-            # Optional: Validate presence of required keys
-            if not all(k in scored_data for k in ["score_percent", "overall_score_percent"]):
-                logging.warning("Scoring response missing required score fields.")
-            logging.info(f"Parsed scored data for {page_range_str}.")
-        except Exception as e:
-            logging.error(f"Failed parsing Scoring AI for {page_range_str}: {e}", exc_info=True)
-            scored_data = None
-    else:
+    # 2b. Call Assistant 2 and parse its response
+    scored_data, raw_json_score = _run_assistant_json(config.ASSISTANT_ID_SCORE, prompt_for_scorer, f"Scoring AI for {page_range_str}", shared_context=scoring_context)
+    if scored_data:
+        # Optional: Validate presence of required keys
+        if not all(k in scored_data for k in ["score_percent", "overall_score_percent"]):
+            logging.warning("Scoring response missing required score fields.")
+        logging.info(f"Parsed scored data for {page_range_str}.")
+    elif not raw_json_score:
         logging.warning(f"No response from Scoring AI for {page_range_str}.")
         raw_json_score = "Error: No response from Scoring AI"
 
@@ -205,7 +293,81 @@ def process_single_resume_group(page_group: list[int], ocr_data: list[str], job_
         logging.warning(f"Scoring failed/unparsed for {page_range_str}. Using placeholder.")
         scored_data = {"score_percent": None, "reasoning": "Scoring failed", "matched_skills": [], "missing_skills": [], "overall_score_percent": None}
         if raw_json_score is None: raw_json_score = scored_data["reasoning"]
+    return scored_data, raw_json_score
+
+def process_single_resume_group(page_group: list[int], ocr_data: list[str], job_description: str) -> tuple[dict | None, dict | None, str | None, str | None]:
+    """
+    Processes a single resume group: aggregates text, calls extraction (1)
+    and scoring (2) assistants, adding date context to scorer prompt.
+
+    Returns:
+        Tuple: (extracted_data, scored_data, raw_json_extract, raw_json_score)
+    """
+    page_range_str = _page_range_str(page_group)
+    logging.info(f"--- Starting processing: Pages {page_range_str} ---")
+
+    # == Step 1: Extraction using Assistant 1 ==
+    extracted_data, raw_json_extract = _extract_resume_group(page_group, ocr_data, page_range_str)
+    if not extracted_data: return None, None, raw_json_extract, None
+
+    # == Step 2: Scoring using Assistant 2 ==
+    scored_data, raw_json_score = _score_extracted(extracted_data, _build_scoring_context(job_description), page_range_str)
 
     logging.info(f"--- Finished processing: Pages {page_range_str} ---")
     # Return results (extracted_data does NOT contain the date)
-    return extracted_data, scored_data, raw_json_extract, raw_json_score
\ No newline at end of file
+    return extracted_data, scored_data, raw_json_extract, raw_json_score
+
+# --- Batched Scoring (config.SCORER_BATCH_SIZE > 1) ---
+_BATCH_SCORING_FORMAT = (
+    "You will receive several candidates at once. Score each one independently, exactly as you would a single candidate, "
+    'and respond with one JSON object of the form {"results": [{"id": <candidate id>, ...that candidate\'s usual score fields...}]} '
+    "containing one entry for every candidate id."
+)
+
+def _score_extracted_batch(items: list[tuple[int, dict, str]], scoring_context: str) -> dict[int, tuple[dict, str]]:
+    """
+    Scores (id, extracted_data, page_range_str) items in one scorer call. Candidates missing from the
+    response (or a failed call, e.g. over the token budget) are retried in halves, down to single calls.
+    """
+    if len(items) == 1:
+        item_id, extracted_data, page_range_str = items[0]
+        return {item_id: _score_extracted(extracted_data, scoring_context, page_range_str)}
+
+    ranges = ", ".join(page_range_str for _, _, page_range_str in items)
+    logging.info(f"Step 2/2: Calling Scorer ({config.ASSISTANT_ID_SCORE}) for {len(items)} candidates ({ranges})...")
+    candidates = [{"id": item_id, "data": extracted_data} for item_id, extracted_data, _ in items]
+    prompt_for_scorer = f"Candidates: ```json\n{orjson.dumps(candidates).decode()}\n```"
+    batch_data, raw_json_score = _run_assistant_json(config.ASSISTANT_ID_SCORE, prompt_for_scorer, f"batched Scoring AI for {ranges}", shared_context=f"{_BATCH_SCORING_FORMAT}\n\n{scoring_context}")
+
+    scored = {}; expected_ids = {item_id for item_id, _, _ in items}
+    if raw_json_score:
+        results = (batch_data or {}).get("results")
+        for result in results if isinstance(results, list) else []:
+            if isinstance(result, dict) and result.get("id") in expected_ids:
+                scored[result.pop("id")] = (result, orjson.dumps(result).decode()) # Same compact raw JSON as _score_extracted
+    else: logging.warning(f"No response from batched Scoring AI for {ranges}.")
+
+    missing = [item for item in items if item[0] not in scored]
+    if missing:
+        logging.warning(f"Batched scoring returned {len(items) - len(missing)}/{len(items)} candidates; retrying {len(missing)} in smaller batches.")
+        half = (len(missing) + 1) // 2
+        for part in (missing[:half], missing[half:]):
+            if part: scored.update(_score_extracted_batch(part, scoring_context))
+    return scored
+
+def process_resume_batch(page_groups: list[list[int]], ocr_data: list[str], job_description: str) -> list[tuple[dict | None, dict | None, str | None, str | None]]:
+    """
+    Extracts each group separately (input sizes vary widely), then scores the extracted candidates
+    together in one call so the shared JD prompt is paid once per batch.
+
+    Returns:
+        One process_single_resume_group-style tuple per page group, in input order.
+    """
+    if len(page_groups) == 1: return [process_single_resume_group(page_groups[0], ocr_data, job_description)]
+    extractions = [_extract_resume_group(page_group, ocr_data, _page_range_str(page_group)) for page_group in page_groups]
+    to_score = [(i, extracted_data, _page_range_str(page_groups[i])) for i, (extracted_data, _) in enumerate(extractions) if extracted_data]
+    scored = _score_extracted_batch(to_score, _build_scoring_context(job_description)) if to_score else {}
+    return [
+        (extracted_data, scored[i][0], raw_json_extract, scored[i][1]) if i in scored else (None, None, raw_json_extract, None)
+        for i, (extracted_data, raw_json_extract) in enumerate(extractions)
+    ]
\ No newline at end of file
@@ -1,16 +1,25 @@
 import logging
 import time
 import re
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import xxhash
 from mistralai import Mistral
-from mistralai.models import OCRResponse
+from mistralai.utils import BackoffStrategy, RetryConfig
+from mistralai.models import OCRResponse, SDKError
 
 import config  # Import configuration
+from services import storage_service  # Persistent OCR cache (per chunk)
 
 # --- Client Initialization ---
 mistral_client = None
 if config.MISTRAL_API_KEY:
     try:
-        mistral_client = Mistral(api_key=config.MISTRAL_API_KEY)
+        # Same settings as the SDK's default client, plus a keep-alive pool shared by the concurrent chunk uploads
+        http_limits = httpx.Limits(max_connections=config.HTTP_MAX_CONNECTIONS, max_keepalive_connections=config.HTTP_MAX_CONNECTIONS, keepalive_expiry=config.HTTP_KEEPALIVE_SECONDS)
+        # Retry 429/5xx and connection errors: 0.5s, 1s, 2s, ... (capped at 10s) until API_RETRY_MAX_ELAPSED_SECONDS
+        retry_config = RetryConfig("backoff", BackoffStrategy(500, 10_000, 2.0, config.API_RETRY_MAX_ELAPSED_SECONDS * 1000), retry_connection_errors=True)
+        mistral_client = Mistral(api_key=config.MISTRAL_API_KEY, client=httpx.Client(follow_redirects=True, limits=http_limits), retry_config=retry_config)
         logging.info("Mistral client initialized successfully.")
     except Exception as e:
         logging.error(f"Failed to initialize Mistral client: {e}", exc_info=True)
@@ -18,16 +27,72 @@ else:
     logging.warning("Mistral API Key not found in config. OCR service will be unavailable.")
 
 # --- Helper Function to Clean Markdown ---
+# Markdown images: ![alt](url). Negated classes match linearly (no lazy-quantifier backtracking)
+_IMAGE_PLACEHOLDER_RE = re.compile(r'!\[[^\]]*\]\([^)]*\)')
+
 def _remove_image_placeholders(markdown_str: str) -> str:
     """Removes markdown image tags ![alt](url) from the given string."""
     if not isinstance(markdown_str, str):
         return ""  # Return empty string if input is not a string
-    # Regex to find markdown images: ![anything](anything)
-    cleaned_str = re.sub(r'!\[.*?\]\(.*?\)', '', markdown_str)
-    return cleaned_str.strip()
+    if '![' not in markdown_str: return markdown_str.strip() # Common case: C substring scan, regex never runs
+    return _IMAGE_PLACEHOLDER_RE.sub('', markdown_str).strip()
+
+# --- Upload Helpers ---
+SIGNED_URL_ATTEMPTS = 5 # A just-uploaded file can briefly 404; backoff 0.2s, 0.4s, ... between attempts
+
+def _get_signed_url(file_id: str):
+    """Fetches the signed URL for an uploaded file, retrying only while the file is not yet available (HTTP 404)."""
+    for attempt in range(SIGNED_URL_ATTEMPTS):
+        try: return mistral_client.files.get_signed_url(file_id=file_id)
+        except SDKError as e:
+            if e.status_code != 404 or attempt == SIGNED_URL_ATTEMPTS - 1: raise
+            logging.info(f"File {file_id} not available yet (attempt {attempt + 1}); retrying.")
+            time.sleep(0.2 * (2 ** attempt))
+
+# --- Chunked OCR Helpers ---
+def _split_pdf(pdf_bytes: bytes, pages_per_chunk: int) -> list[bytes]:
+    """Splits a PDF into standalone PDFs of up to pages_per_chunk pages (byte-stable across runs)."""
+    import fitz  # PyMuPDF; imported here so importing this module stays cheap
+    chunks = []
+    # Private document: the app's shared fitz.Document may be rendering previews on other threads
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+        for start in range(0, len(pdf_doc), pages_per_chunk):
+            with fitz.open() as part:
+                part.insert_pdf(pdf_doc, from_page=start, to_page=min(start + pages_per_chunk, len(pdf_doc)) - 1)
+                chunks.append(part.tobytes(garbage=3, deflate=True, no_new_id=True)) # no_new_id -> same pages, same hash
+    return chunks
+
+def _ocr_chunk_cached(chunk_name: str, chunk_bytes: bytes) -> list[str] | None:
+    """OCRs one chunk, reusing a stored result when identical pages were seen before."""
+    chunk_hash = f"{xxhash.xxh3_64_intdigest(chunk_bytes):016x}"
+    cached_pages = storage_service.get_ocr_by_hash(chunk_hash)
+    if cached_pages is not None: return cached_pages
+    pages = perform_ocr(chunk_name, chunk_bytes)
+    if pages: storage_service.save_ocr(chunk_hash, pages) # Saved as soon as it lands, so a failed sibling chunk costs only itself on retry
+    return pages
+
+def _perform_ocr_chunked(pdf_name: str, pdf_bytes: bytes, page_count: int) -> list[str] | None:
+    """Runs OCR on page chunks concurrently and stitches the per-page results back in order."""
+    chunks = _split_pdf(pdf_bytes, config.OCR_PAGES_PER_CHUNK)
+    base_name = pdf_name.rsplit('.', 1)[0]
+    chunk_names = [f"{base_name}_part{i + 1}.pdf" for i in range(len(chunks))]
+    logging.info(f"OCR for {pdf_name}: {page_count} pages in {len(chunks)} chunks ({config.OCR_MAX_WORKERS} concurrent).")
+    with ThreadPoolExecutor(max_workers=config.OCR_MAX_WORKERS) as executor:
+        results = list(executor.map(_ocr_chunk_cached, chunk_names, chunks))
+
+    extracted_markdowns: list[str] = []
+    for i, chunk_pages in enumerate(results):
+        if chunk_pages is None:
+            logging.error(f"OCR failed for {chunk_names[i]}; aborting OCR for {pdf_name}."); return None
+        expected = min(config.OCR_PAGES_PER_CHUNK, page_count - i * config.OCR_PAGES_PER_CHUNK)
+        if len(chunk_pages) != expected: # Keep page numbering aligned with the PDF
+            logging.warning(f"{chunk_names[i]}: expected {expected} OCR pages, got {len(chunk_pages)}. Padding/truncating.")
+            chunk_pages = (chunk_pages + [""] * expected)[:expected]
+        extracted_markdowns.extend(chunk_pages)
+    return extracted_markdowns
 
 # --- Core OCR Function ---
-def perform_ocr(pdf_name: str, pdf_bytes: bytes) -> list[str] | None:
+def perform_ocr(pdf_name: str, pdf_bytes: bytes, page_count: int = 0) -> list[str] | None:
     """
     Uploads a PDF, performs OCR using Mistral AI (text only), cleans image
     placeholders, and returns a list of markdown strings per page.
@@ -35,6 +100,8 @@ def perform_ocr(pdf_name: str, pdf_bytes: bytes) -> list[str] | None:
     Args:
         pdf_name: The original filename of the PDF.
         pdf_bytes: The content of the PDF file as bytes.
+        page_count: Optional page count of the PDF. When it exceeds config.OCR_PAGES_PER_CHUNK,
+                    the PDF is split and the chunks are OCRed concurrently.
 
     Returns:
         A list of strings, where each string is the cleaned markdown content of a page,
@@ -47,6 +114,8 @@ def perform_ocr(pdf_name: str, pdf_bytes: bytes) -> list[str] | None:
     if not pdf_name or not pdf_bytes:
         logging.error("PDF name or bytes are missing.")
         return None
+    if page_count > config.OCR_PAGES_PER_CHUNK:
+        return _perform_ocr_chunked(pdf_name, pdf_bytes, page_count)
 
     logging.info(f"Starting OCR process for PDF: {pdf_name}")
     try:
@@ -61,20 +130,17 @@ def perform_ocr(pdf_name: str, pdf_bytes: bytes) -> list[str] | None:
         if not uploaded_file or not uploaded_file.id:
             raise ValueError("File upload failed or did not return a valid file ID.")
         logging.info(f"PDF uploaded successfully in {upload_duration:.2f}s. File ID: {uploaded_file.id}")
-        
-        # Optional short delay to ensure file availability
-        time.sleep(1)
 
-        # 2. Get Temporary Signed URL (using default expiry)
+        # 2. Get Temporary Signed URL (using default expiry; retried briefly if the upload is not visible yet)
         logging.info("Step 2/3: Retrieving temporary signed URL...")
         start_url = time.time()
-        signed_url = mistral_client.files.get_signed_url(file_id=uploaded_file.id)
+        signed_url = _get_signed_url(uploaded_file.id)
         url_duration = time.time() - start_url
         if not signed_url or not signed_url.url:
             raise ValueError("Failed to retrieve a valid signed URL.")
         logging.info(f"Signed URL obtained in {url_duration:.2f}s.")
 
-        # 3. Process OCR via API (Synchronous, Text Only)
+        # 3. Process OCR via API (Synchronous, Text Only; all pages are OCRed server-side in this one request)
         logging.info(f"Step 3/3: Calling Mistral OCR API (model: {config.OCR_MODEL}, text only)...")
         start_ocr = time.time()
         ocr_response: OCRResponse = mistral_client.ocr.process(
@@ -92,12 +158,8 @@ def perform_ocr(pdf_name: str, pdf_bytes: bytes) -> list[str] | None:
         extracted_markdowns: list[str] = []
         if ocr_response and hasattr(ocr_response, 'pages') and ocr_response.pages:
             logging.info(f"Extracting and cleaning markdown from {len(ocr_response.pages)} pages...")
-            for page_index, page in enumerate(ocr_response.pages):
-                raw_markdown = getattr(page, 'markdown', '')
-                cleaned_markdown = _remove_image_placeholders(raw_markdown)
-                extracted_markdowns.append(cleaned_markdown)
-                logging.debug(f"Page {page_index + 1}: Cleaned markdown length: {len(cleaned_markdown)}")
-            logging.info("Finished extracting and cleaning markdown.")
+            extracted_markdowns = [_remove_image_placeholders(getattr(page, 'markdown', '')) for page in ocr_response.pages]
+            logging.info(f"Finished extracting and cleaning markdown ({sum(map(len, extracted_markdowns))} chars).")
         elif ocr_response and hasattr(ocr_response, 'pages') and not ocr_response.pages:
             logging.info("OCR process successful, but the response contained 0 pages.")
         else:
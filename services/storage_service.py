@@ -1,8 +1,13 @@
 # services/storage_service.py
 import sqlite3
-import json
+import orjson
 import logging
-from datetime import datetime
+import zlib
+import atexit
+import threading
+import weakref
+import functools
+import itertools
 
 # --- Project Modules ---
 try:
@@ -15,83 +20,182 @@ except ImportError:
 
 DATABASE_FILE = config.DATABASE_NAME
 
+# --- Connection Handling ---
+# One connection per thread, opened and configured on first use. `with _get_conn() as conn:` is a transaction
+# (commit on success, rollback on error); it does not close the connection.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL;", # Crash-safe under WAL (set once in init_db), with no fsync per commit
+    "PRAGMA foreign_keys = ON;", # Per-connection setting; needed for ON DELETE CASCADE
+    "PRAGMA temp_store = MEMORY;", # Sorter/temp b-trees stay off disk
+    "PRAGMA cache_size = -20000;", # ~20 MB page cache, kept warm across calls
+    "PRAGMA mmap_size = 268435456;", # Read through a 256 MB memory map instead of read() copies
+    "PRAGMA threads = 4;", # Helper threads for any sort an index cannot serve (e.g. CREATE INDEX, ad-hoc ORDER BY)
+)
+
+class _ThreadConnection(sqlite3.Connection):
+    """sqlite3.Connection that can be weak-referenced, so atexit can close whichever ones are still open."""
+
+_thread_state = threading.local()
+_open_connections = weakref.WeakSet() # Entries vanish when a connection's thread ends and it is collected
+
+def _get_conn() -> sqlite3.Connection:
+    """Returns the calling thread's connection to DATABASE_FILE."""
+    conn = getattr(_thread_state, "conn", None)
+    if conn is None:
+        # check_same_thread=False only so the atexit hook may close it; the connection is never shared between threads.
+        # IMMEDIATE: implicit write transactions take the write lock up front instead of upgrading mid-way (SQLITE_BUSY)
+        conn = sqlite3.connect(DATABASE_FILE, factory=_ThreadConnection, check_same_thread=False, isolation_level="IMMEDIATE")
+        for pragma in CONNECTION_PRAGMAS: conn.execute(pragma)
+        _thread_state.conn = conn; _open_connections.add(conn)
+    return conn
+
+@atexit.register
+def _close_connections():
+    for conn in list(_open_connections):
+        try: conn.execute("PRAGMA optimize;") # Lets SQLite re-ANALYZE whatever this connection's queries found stale
+        except sqlite3.Error as e: logging.warning(f"PRAGMA optimize on close failed: {e}")
+        conn.close(); _open_connections.discard(conn)
+
+OPTIMIZE_EVERY_INSERTS = 500 # Long-running apps also optimize periodically, not only at exit
+_inserts_since_optimize = 0
+_inserts_lock = threading.Lock() # Inserts arrive from several threads, each on its own connection
+
+def _count_inserts(conn: sqlite3.Connection, count: int):
+    """Tracks stored candidates (process-wide) and runs PRAGMA optimize every OPTIMIZE_EVERY_INSERTS rows."""
+    global _inserts_since_optimize
+    with _inserts_lock:
+        _inserts_since_optimize += count
+        due = _inserts_since_optimize >= OPTIMIZE_EVERY_INSERTS
+        if due: _inserts_since_optimize = 0
+    if due: conn.execute("PRAGMA optimize;") # Outside the lock: only the thread that crossed the threshold runs it
+
+# Stored in PRAGMA user_version once init_db has brought a DB up to date; bump whenever the schema below changes
+SCHEMA_VERSION = 2 # v2: candidate_name/email columns
+
+# Full schema: every statement is IF NOT EXISTS, so it creates whatever is missing on fresh or old DBs.
+# Executed one by one inside init_db's single transaction (executescript would COMMIT whatever ran before it).
+_SCHEMA_STATEMENTS = (
+    """CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_name TEXT UNIQUE NOT NULL, pdf_filename TEXT,
+    job_description_snippet TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)""",
+    # ** REMOVED extraction_date column **
+    """CREATE TABLE IF NOT EXISTS candidates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    resume_page_range TEXT, processing_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    job_description_used TEXT, personal_information TEXT, professional_summary TEXT,
+    work_experience TEXT, education TEXT, skills TEXT, certifications TEXT,
+    score_percent REAL, score_reasoning TEXT, matched_skills TEXT, missing_skills TEXT,
+    raw_assistant1_json BLOB, raw_assistant2_json BLOB, -- zlib-compressed UTF-8 (rows from older versions hold plain TEXT)
+    job_id INTEGER, -- Defined here
+    total_years_experience REAL, total_internship_duration TEXT, overall_score_percent REAL,
+    candidate_name TEXT, email TEXT, -- Copied out of personal_information at insert time
+    FOREIGN KEY (job_id) REFERENCES jobs(job_id) ON DELETE CASCADE
+)""",
+    # OCR results keyed by PDF content fingerprint (zlib-compressed JSON list of page markdowns)
+    """CREATE TABLE IF NOT EXISTS ocr_cache (
+    pdf_hash TEXT PRIMARY KEY, page_count INTEGER,
+    ocr_json BLOB, created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+)""",
+    # Results query is WHERE job_id = ? ORDER BY score_percent DESC, overall_score_percent DESC -> ordered range scan, no sort
+    "CREATE INDEX IF NOT EXISTS idx_candidates_job_score ON candidates (job_id, score_percent DESC, overall_score_percent DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at DESC)", # load_job_list order
+    "CREATE INDEX IF NOT EXISTS idx_candidates_email ON candidates (email)", # Duplicate-applicant lookups
+    f"PRAGMA user_version = {SCHEMA_VERSION}", # Transactional: only lands together with the schema it describes
+)
+
+# Columns added after the first release; older candidates tables get them via ALTER TABLE
+_MIGRATED_CANDIDATE_COLUMNS = {
+    "job_id": "INTEGER REFERENCES jobs(job_id) ON DELETE CASCADE",
+    "total_years_experience": "REAL",
+    "total_internship_duration": "TEXT",
+    "overall_score_percent": "REAL",
+    "candidate_name": "TEXT",
+    "email": "TEXT"
+}
+
+def _json_field_sql(column: str, path: str, missing: str = "NULL", invalid: str = "'Error'") -> str:
+    """SQL expression extracting `path` from a JSON text column; json_valid guards against malformed rows."""
+    return (f"CASE WHEN {column} IS NULL OR {column} = '' THEN {missing} "
+            f"WHEN json_valid({column}) THEN COALESCE(json_extract({column}, '{path}'), {missing}) "
+            f"ELSE {invalid} END")
+
+# Fills candidate_name/email for rows stored before those columns existed (same values the old SELECT derived)
+_BACKFILL_NAME_EMAIL_SQL = ("UPDATE candidates SET candidate_name = " + _json_field_sql("personal_information", "$.full_name") +
+                            ", email = " + _json_field_sql("personal_information", "$.email", invalid="''"))
+
+def _migrate_candidates_table(cursor: sqlite3.Cursor):
+    """Adds any _MIGRATED_CANDIDATE_COLUMNS missing from an existing candidates table."""
+    existing_columns = {info[1] for info in cursor.execute("PRAGMA table_info(candidates)").fetchall()}
+    for col_name, col_type in _MIGRATED_CANDIDATE_COLUMNS.items():
+        if col_name not in existing_columns:
+            try:
+                # Split type from constraint for ALTER ADD COLUMN syntax if needed
+                base_col_type = col_type.split(" ")[0]
+                cursor.execute(f"ALTER TABLE candidates ADD COLUMN {col_name} {base_col_type}")
+                logging.info(f"Added '{col_name}' column to 'candidates' table.")
+                # Note: Foreign key constraints might need separate handling or table recreation
+            except sqlite3.OperationalError as alter_err:
+                logging.warning(f"Could not add '{col_name}' column via ALTER TABLE: {alter_err}")
+    if "candidate_name" not in existing_columns: cursor.execute(_BACKFILL_NAME_EMAIL_SQL); logging.info("Backfilled candidate_name/email columns.")
+
 def init_db():
     """Initializes DB with jobs and candidates tables (NO extraction_date column)."""
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with _get_conn() as conn:
             cursor = conn.cursor()
-            # Create jobs table
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS jobs (
-                job_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                job_name TEXT UNIQUE NOT NULL, pdf_filename TEXT,
-                job_description_snippet TEXT, created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            );
-            """)
-
-            # Check existing columns before potentially altering
-            cursor.execute("PRAGMA table_info(candidates)")
-            existing_columns = [info[1] for info in cursor.fetchall()]
-
-            # Define required columns (ensure foreign key and cascade delete)
-            required_columns = {
-                "job_id": "INTEGER REFERENCES jobs(job_id) ON DELETE CASCADE",
-                "total_years_experience": "REAL",
-                "total_internship_duration": "TEXT",
-                "overall_score_percent": "REAL"
-            }
-
-            # Add missing columns if possible
-            for col_name, col_type in required_columns.items():
-                if col_name not in existing_columns:
-                    try:
-                        # Split type from constraint for ALTER ADD COLUMN syntax if needed
-                        base_col_type = col_type.split(" ")[0]
-                        cursor.execute(f"ALTER TABLE candidates ADD COLUMN {col_name} {base_col_type}")
-                        logging.info(f"Added '{col_name}' column to 'candidates' table.")
-                        # Note: Foreign key constraints might need separate handling or table recreation
-                    except sqlite3.OperationalError as alter_err:
-                        logging.warning(f"Could not add '{col_name}' column via ALTER TABLE: {alter_err}")
-
-
-            # Ensure candidates table exists with the final schema
-            # ** REMOVED extraction_date column **
-            cursor.execute("""
-            CREATE TABLE IF NOT EXISTS candidates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                resume_page_range TEXT, processing_timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                job_description_used TEXT, personal_information TEXT, professional_summary TEXT,
-                work_experience TEXT, education TEXT, skills TEXT, certifications TEXT,
-                score_percent REAL, score_reasoning TEXT, matched_skills TEXT, missing_skills TEXT,
-                raw_assistant1_json TEXT, raw_assistant2_json TEXT,
-                job_id INTEGER, -- Defined here
-                total_years_experience REAL, total_internship_duration TEXT, overall_score_percent REAL,
-                FOREIGN KEY (job_id) REFERENCES jobs(job_id) ON DELETE CASCADE
-            );
-            """)
-            conn.commit()
+            # Up-to-date DB (WAL, page size, schema and stats are all persistent in the file): one PRAGMA read and done
+            if cursor.execute("PRAGMA user_version;").fetchone()[0] == SCHEMA_VERSION:
+                cursor.execute("PRAGMA optimize;"); logging.info(f"DB '{DATABASE_FILE}' schema is current (v{SCHEMA_VERSION})."); return
+            # page_size only takes effect before the first table exists (afterwards WAL forbids a change); 4096 matches the OS page for the mmap
+            cursor.execute("PRAGMA page_size = 4096;")
+            # WAL is persistent in the DB file: readers no longer block the Step 4 writer, and commits append instead of rewriting
+            journal_mode = cursor.execute("PRAGMA journal_mode = WAL;").fetchone()[0]
+            if journal_mode.lower() != 'wal': logging.warning(f"Could not enable WAL (journal_mode={journal_mode}).")
+            # One explicit transaction (DDL opens no implicit one) for migration, schema and user_version; any error rolls back all of it
+            cursor.execute("BEGIN IMMEDIATE;")
+            # Re-check under the write lock: a concurrent starter may have finished the upgrade while this one waited
+            if cursor.execute("PRAGMA user_version;").fetchone()[0] == SCHEMA_VERSION:
+                logging.info(f"DB '{DATABASE_FILE}' schema was upgraded concurrently (v{SCHEMA_VERSION})."); return
+            # Fresh DBs skip introspection/ALTERs entirely; existing ones are migrated first so the indexes find job_id
+            if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'candidates'").fetchone():
+                _migrate_candidates_table(cursor)
+            for statement in _SCHEMA_STATEMENTS: cursor.execute(statement)
+            # Give the planner statistics once (sqlite_stat1 appears on first ANALYZE); not re-run on every startup
+            if not cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone(): cursor.execute("ANALYZE;")
+            cursor.execute("PRAGMA optimize;")
             logging.info(f"DB '{DATABASE_FILE}' schema checked/updated.")
     except sqlite3.Error as e:
         logging.error(f"DB init error: {e}", exc_info=True); raise
 
 # --- Job Management Functions ---
+# SQL text is module-level so each pooled connection's statement cache (keyed on the exact string) is hit on reuse
+# SQLite 3.35+ hands back the new row id from the INSERT itself; older libraries fall back to cursor.lastrowid
+_RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+_CREATE_JOB_SQL = "INSERT INTO jobs (job_name, pdf_filename, job_description_snippet) VALUES (?, ?, ?)" + (" RETURNING job_id" if _RETURNING_SUPPORTED else "")
+_GET_JOB_ID_SQL = "SELECT job_id FROM jobs WHERE job_name = ?"
+_LOAD_JOBS_SQL = "SELECT job_id, job_name, pdf_filename, created_at FROM jobs ORDER BY created_at DESC"
+_JOB_KEYS = ("job_id", "job_name", "pdf_filename", "created_at") # _LOAD_JOBS_SQL column order
+_DELETE_JOB_CANDIDATES_SQL = "DELETE FROM candidates WHERE job_id = ?" # Range delete on idx_candidates_job_score's job_id prefix
+_DELETE_JOB_SQL = "DELETE FROM jobs WHERE job_id = ?"
+ANALYZE_AFTER_DELETED_ROWS = 1000 # Refresh planner statistics once a delete removes this many candidates
+
 def create_job(job_name: str, pdf_filename: str, job_desc_snippet: str) -> int | None:
     """Creates a new job record or retrieves existing ID if name exists."""
-    sql = "INSERT INTO jobs (job_name, pdf_filename, job_description_snippet) VALUES (?, ?, ?)"
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor(); cursor.execute(sql, (job_name, pdf_filename, job_desc_snippet)); conn.commit()
-            job_id = cursor.lastrowid; logging.info(f"Created job '{job_name}' (ID: {job_id})"); return job_id
+        with _get_conn() as conn:
+            cursor = conn.execute(_CREATE_JOB_SQL, (job_name, pdf_filename, job_desc_snippet))
+            job_id = cursor.fetchone()[0] if _RETURNING_SUPPORTED else cursor.lastrowid; logging.info(f"Created job '{job_name}' (ID: {job_id})"); return job_id
     except sqlite3.IntegrityError: # Likely UNIQUE constraint violation
          logging.warning(f"Job '{job_name}' exists. Getting ID."); return get_job_id_by_name(job_name)
     except sqlite3.Error as e: logging.error(f"DB error creating job '{job_name}': {e}",exc_info=True); return None
 
 def get_job_id_by_name(job_name: str) -> int | None:
     """Retrieves the ID of a job given its unique name."""
-    sql = "SELECT job_id FROM jobs WHERE job_name = ?"
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor(); result=cursor.execute(sql,(job_name,)).fetchone()
+        with _get_conn() as conn:
+            cursor = conn.cursor(); result=cursor.execute(_GET_JOB_ID_SQL,(job_name,)).fetchone()
             if result: return result[0]
             else: logging.warning(f"No job found with name '{job_name}'."); return None
     except sqlite3.Error as e: logging.error(f"DB error retrieving job ID for '{job_name}': {e}",exc_info=True); return None
@@ -100,105 +204,216 @@ def load_job_list() -> list[dict]:
     """Loads a list of all jobs, most recent first."""
     jobs = [];
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            conn.row_factory=sqlite3.Row
-            query="SELECT job_id, job_name, pdf_filename, created_at FROM jobs ORDER BY created_at DESC"
-            cursor=conn.cursor(); results=cursor.execute(query).fetchall()
-            jobs=[dict(row) for row in results]; logging.info(f"Loaded {len(jobs)} job records.")
+        with _get_conn() as conn:
+            results=conn.execute(_LOAD_JOBS_SQL).fetchall() # Plain tuples: no sqlite3.Row objects or column-name lookups
+            jobs=[dict(zip(_JOB_KEYS, row)) for row in results]; logging.info(f"Loaded {len(jobs)} job records.")
     except sqlite3.Error as e: logging.error(f"DB error loading job list: {e}", exc_info=True)
     return jobs
 
 def delete_job_and_candidates(job_id: int) -> bool:
     """Deletes a job and all associated candidates using CASCADE DELETE."""
     if not job_id: logging.warning("Delete attempt with invalid job ID."); return False
-    sql = "DELETE FROM jobs WHERE job_id = ?"
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            conn.execute("PRAGMA foreign_keys = ON;") # IMPORTANT: Enable FKs for CASCADE
-            cursor = conn.cursor(); cursor.execute(sql, (job_id,)); conn.commit()
-            if cursor.rowcount > 0: logging.info(f"Deleted job ID {job_id} and candidates."); return True
-            else: logging.warning(f"No job found with ID {job_id} to delete."); return False
+        with _get_conn() as conn: # One transaction for both deletes
+            # Candidates first, explicitly, so their count is known; the CASCADE (foreign_keys=ON) then has nothing left to do
+            deleted_candidates = conn.execute(_DELETE_JOB_CANDIDATES_SQL, (job_id,)).rowcount
+            deleted_jobs = conn.execute(_DELETE_JOB_SQL, (job_id,)).rowcount
+        if deleted_candidates >= ANALYZE_AFTER_DELETED_ROWS: _get_conn().execute("ANALYZE candidates;") # Stats are stale after large churn
+        if deleted_jobs > 0: logging.info(f"Deleted job ID {job_id} and {deleted_candidates} candidates."); return True
+        else: logging.warning(f"No job found with ID {job_id} to delete."); return False
     except sqlite3.Error as e: logging.error(f"DB error deleting job ID {job_id}: {e}", exc_info=True); return False
 
+# --- OCR Cache Functions ---
+_GET_OCR_SQL = "SELECT ocr_json FROM ocr_cache WHERE pdf_hash = ?"
+_SAVE_OCR_SQL = "INSERT OR REPLACE INTO ocr_cache (pdf_hash, page_count, ocr_json) VALUES (?, ?, ?)"
+
+def get_ocr_by_hash(pdf_hash: str) -> list[str] | None:
+    """Returns the cached OCR page markdowns for a PDF fingerprint, or None on miss/error."""
+    if not pdf_hash: return None
+    try:
+        with _get_conn() as conn:
+            result = conn.execute(_GET_OCR_SQL, (pdf_hash,)).fetchone()
+        if not result: return None
+        pages = orjson.loads(zlib.decompress(result[0])); logging.info(f"OCR cache hit for {pdf_hash} ({len(pages)} pages)."); return pages
+    except (sqlite3.Error, zlib.error, ValueError) as e: logging.error(f"Error reading OCR cache for {pdf_hash}: {e}", exc_info=True); return None
+
+def save_ocr(pdf_hash: str, ocr_pages: list[str]) -> bool:
+    """Stores (or replaces) the OCR page markdowns for a PDF fingerprint."""
+    if not pdf_hash or ocr_pages is None: return False
+    try:
+        blob = zlib.compress(orjson.dumps(ocr_pages))
+        with _get_conn() as conn:
+            conn.execute(_SAVE_OCR_SQL, (pdf_hash, len(ocr_pages), blob))
+        logging.info(f"Saved OCR for {pdf_hash} ({len(ocr_pages)} pages, {len(blob)} bytes)."); return True
+    except sqlite3.Error as e: logging.error(f"DB error saving OCR for {pdf_hash}: {e}", exc_info=True); return False
+
 # --- Candidate Data Functions ---
-def store_candidate_data(job_id: int, page_range: str, job_desc: str, assistant1_data: dict, assistant2_data: dict, raw1_json: str | None, raw2_json: str | None) -> int | None:
-    """Stores processed candidate data linked to a specific job."""
-    if not job_id: logging.error("Store failed: invalid job_id."); return None
+_INSERT_CANDIDATE_HEAD_SQL = """
+INSERT INTO candidates (
+    job_id, resume_page_range, job_description_used,
+    personal_information, professional_summary, work_experience, education, skills, certifications,
+    score_percent, score_reasoning, matched_skills, missing_skills,
+    raw_assistant1_json, raw_assistant2_json, processing_timestamp,
+    total_years_experience, total_internship_duration, overall_score_percent, candidate_name, email
+) VALUES """
+_CANDIDATE_VALUES_ROW = "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'), ?, ?, ?, ?, ?)"
+_CANDIDATE_PARAM_COUNT = 20 # (** WITHOUT extraction_date **); SQLite stamps processing_timestamp itself
+_INSERT_CANDIDATE_SQL = _INSERT_CANDIDATE_HEAD_SQL + _CANDIDATE_VALUES_ROW
+_INSERT_CANDIDATE_RETURNING_SQL = (_INSERT_CANDIDATE_SQL + " RETURNING id") if _RETURNING_SUPPORTED else _INSERT_CANDIDATE_SQL # Single-row path only
+# Bulk inserts put many rows in one VALUES list; 999 is the lowest host-parameter limit any SQLite build uses
+_BULK_INSERT_ROWS = 999 // _CANDIDATE_PARAM_COUNT
+
+@functools.lru_cache(maxsize=None)
+def _bulk_insert_sql(row_count: int) -> str:
+    """INSERT with `row_count` VALUES tuples; memoized so each batch size maps to one cached statement."""
+    return _INSERT_CANDIDATE_HEAD_SQL + ", ".join([_CANDIDATE_VALUES_ROW] * row_count)
+
+def _insert_candidate_rows(conn: sqlite3.Connection, params: list[tuple]):
+    """Inserts candidate parameter tuples using multi-row VALUES statements of up to _BULK_INSERT_ROWS rows."""
+    for start in range(0, len(params), _BULK_INSERT_ROWS):
+        chunk = params[start:start + _BULK_INSERT_ROWS]
+        conn.execute(_bulk_insert_sql(len(chunk)), list(itertools.chain.from_iterable(chunk)))
+
+_EMPTY_OBJECT_JSON = "{}"
+_EMPTY_ARRAY_JSON = "[]"
+
+def _to_json_text(value, empty: str) -> str:
+    """Serializes a JSON field as TEXT (orjson); missing/empty containers reuse a constant instead of encoding."""
+    if value is None or (isinstance(value, (dict, list)) and not value): return empty
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode() # Non-str keys stringified, as json.dumps did
+
+def _raw_blob(raw) -> bytes | None:
+    """Raw assistant output as a zlib-compressed UTF-8 BLOB; parsed objects are encoded once with orjson."""
+    if not raw: return None
+    if isinstance(raw, str): raw = raw.encode("utf-8")
+    elif not isinstance(raw, (bytes, bytearray)): raw = orjson.dumps(raw, option=orjson.OPT_NON_STR_KEYS)
+    return zlib.compress(raw)
+
+def _json_scalar(value):
+    """A JSON value as SQLite would return it from json_extract: scalars as-is, containers as JSON text."""
+    if value is None or isinstance(value, (str, int, float)): return value
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+
+def _parse_num(val) -> float | None:
+    """Parses a numeric field defensively; numbers skip the try/except entirely."""
+    if val is None: return None
+    if isinstance(val, (int, float)): return float(val)
+    try: return float(val)
+    except (TypeError, ValueError): logging.warning(f"Failed parsing '{val}' as number."); return None
+
+def _candidate_params(job_id: int, page_range: str, job_desc: str, assistant1_data: dict, assistant2_data: dict, raw1_json: str | None, raw2_json: str | None) -> tuple:
+    """Builds the INSERT parameter tuple for one candidate from the assistants' output."""
     if not assistant1_data: assistant1_data = {}
     if not assistant2_data: assistant2_data = {}
 
+    # Extract scalar/simple fields
+    professional_summary=assistant1_data.get('professional_summary')
+    work_exp_obj=assistant1_data.get('work_experience',{})
+    total_years_experience=work_exp_obj.get('total_years_experience')
+    total_internship_duration=work_exp_obj.get('total_internship_duration')
+    score_reasoning=assistant2_data.get('reasoning')
+    personal_info=assistant1_data.get('personal_information')
+    if not isinstance(personal_info, dict): personal_info = {}
+    candidate_name=_json_scalar(personal_info.get('full_name')); email=_json_scalar(personal_info.get('email'))
+
+    score_percent=_parse_num(assistant2_data.get('score_percent'))
+    overall_score_percent=_parse_num(assistant2_data.get('overall_score_percent'))
+
+    # Prepare JSON fields
+    personal_info_json=_to_json_text(assistant1_data.get('personal_information'), _EMPTY_OBJECT_JSON)
+    work_exp_json=_to_json_text(work_exp_obj, _EMPTY_OBJECT_JSON) # Store full work_exp object
+    education_json=_to_json_text(assistant1_data.get('education'), _EMPTY_ARRAY_JSON)
+    skills_json=_to_json_text(assistant1_data.get('skills'), _EMPTY_ARRAY_JSON)
+    certs_json=_to_json_text(assistant1_data.get('certifications'), _EMPTY_ARRAY_JSON)
+    matched_skills_json=_to_json_text(assistant2_data.get('matched_skills'), _EMPTY_ARRAY_JSON)
+    missing_skills_json=_to_json_text(assistant2_data.get('missing_skills'), _EMPTY_ARRAY_JSON)
+
+    return (
+        job_id, page_range, job_desc,
+        personal_info_json, professional_summary, work_exp_json, education_json, skills_json, certs_json,
+        score_percent, score_reasoning, matched_skills_json, missing_skills_json,
+        _raw_blob(raw1_json), _raw_blob(raw2_json),
+        total_years_experience, total_internship_duration, overall_score_percent, # Use parsed scores
+        candidate_name, email
+    )
+
+def store_candidate_data(job_id: int, page_range: str, job_desc: str, assistant1_data: dict, assistant2_data: dict, raw1_json: str | None, raw2_json: str | None) -> int | None:
+    """Stores processed candidate data linked to a specific job."""
+    if not job_id: logging.error("Store failed: invalid job_id."); return None
     try:
-        # Extract scalar/simple fields
-        professional_summary=assistant1_data.get('professional_summary')
-        work_exp_obj=assistant1_data.get('work_experience',{})
-        total_years_experience=work_exp_obj.get('total_years_experience')
-        total_internship_duration=work_exp_obj.get('total_internship_duration')
-        score_reasoning=assistant2_data.get('reasoning')
-
-        # Parse numeric fields defensively
-        def _parse_num(val):
-             if val is None: return None
-             try: return float(val)
-             except: logging.warning(f"Failed parsing '{val}' as number."); return None
-        score_percent=_parse_num(assistant2_data.get('score_percent'))
-        overall_score_percent=_parse_num(assistant2_data.get('overall_score_percent'))
-
-        # Prepare JSON fields
-        personal_info_json=json.dumps(assistant1_data.get('personal_information',{}))
-        work_exp_json=json.dumps(work_exp_obj) # Store full work_exp object
-        education_json=json.dumps(assistant1_data.get('education',[]))
-        skills_json=json.dumps(assistant1_data.get('skills',[]))
-        certs_json=json.dumps(assistant1_data.get('certifications',[]))
-        matched_skills_json=json.dumps(assistant2_data.get('matched_skills',[]))
-        missing_skills_json=json.dumps(assistant2_data.get('missing_skills',[]))
-
-        # ** SQL and Params WITHOUT extraction_date **
-        sql = """
-        INSERT INTO candidates (
-            job_id, resume_page_range, job_description_used,
-            personal_information, professional_summary, work_experience, education, skills, certifications,
-            score_percent, score_reasoning, matched_skills, missing_skills,
-            raw_assistant1_json, raw_assistant2_json, processing_timestamp,
-            total_years_experience, total_internship_duration, overall_score_percent
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """ # 19 parameters total
-        params = (
-            job_id, page_range, job_desc,
-            personal_info_json, professional_summary, work_exp_json, education_json, skills_json, certs_json,
-            score_percent, score_reasoning, matched_skills_json, missing_skills_json,
-            str(raw1_json) if raw1_json else None, str(raw2_json) if raw2_json else None, datetime.now(),
-            total_years_experience, total_internship_duration, overall_score_percent # Use parsed scores
-        )
-
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor(); conn.execute("PRAGMA foreign_keys = ON;")
-            cursor.execute(sql, params); conn.commit()
-            last_id = cursor.lastrowid; logging.info(f"Stored candidate ID: {last_id}"); return last_id
+        params = _candidate_params(job_id, page_range, job_desc, assistant1_data, assistant2_data, raw1_json, raw2_json)
+        with _get_conn() as conn:
+            cursor = conn.execute(_INSERT_CANDIDATE_RETURNING_SQL, params)
+            last_id = cursor.fetchone()[0] if _RETURNING_SUPPORTED else cursor.lastrowid
+        _count_inserts(conn, 1); logging.info(f"Stored candidate ID: {last_id}"); return last_id
     except sqlite3.Error as e: logging.error(f"DB error storing candidate: {e}", exc_info=True); return None
     except Exception as e: logging.error(f"Unexpected error storing candidate: {e}", exc_info=True); return None
 
-def load_candidates_for_job(job_id: int) -> list[dict]:
-    """Loads candidate data for a specific job ID (NO extraction_date)."""
-    if not job_id: return []
-    data = []
-    # ** Select columns WITHOUT extraction_date **
-    select_cols = [
-        'id', 'resume_page_range', 'score_percent', 'score_reasoning',
-        'personal_information', 'skills', 'matched_skills', 'missing_skills',
-        'processing_timestamp', 'total_years_experience', 'total_internship_duration',
-        'overall_score_percent'
-    ]
-    select_cols_str = ", ".join(select_cols)
+def store_candidates_bulk(records: list[tuple]) -> int:
+    """
+    Stores many candidates in a single transaction (one commit/fsync for the batch).
+
+    Args:
+        records: Tuples of (job_id, page_range, job_desc, assistant1_data, assistant2_data, raw1_json, raw2_json),
+                 i.e. the store_candidate_data arguments.
+
+    Returns:
+        The number of rows stored (0 if the batch failed and was rolled back).
+    """
+    if not records: return 0
+    try:
+        params = []
+        for record in records:
+            if not record[0]: logging.error(f"Bulk store: skipping record with invalid job_id (pages {record[1]})."); continue
+            params.append(_candidate_params(*record))
+        if not params: return 0
+        with _get_conn() as conn:
+            _insert_candidate_rows(conn, params)
+        _count_inserts(conn, len(params)); logging.info(f"Stored {len(params)} candidates in one batch."); return len(params)
+    except sqlite3.Error as e: logging.error(f"DB error bulk storing {len(records)} candidates: {e}", exc_info=True); return 0
+    except Exception as e: logging.error(f"Unexpected error bulk storing candidates: {e}", exc_info=True); return 0
+
+# ** Select only displayed columns; name/email are plain columns, no JSON parsing on read **
+_SELECT_CANDIDATE_COLUMNS = ", ".join([
+    'id', 'resume_page_range', 'CAST(score_percent AS INTEGER) AS score_percent', 'score_reasoning',
+    'matched_skills', 'missing_skills',
+    'processing_timestamp', 'total_years_experience', 'total_internship_duration',
+    'CAST(overall_score_percent AS INTEGER) AS overall_score_percent', # Scores arrive as int-or-None
+    "COALESCE(candidate_name, 'N/A') AS candidate_name", "COALESCE(email, 'N/A') AS email",
+])
+_GET_RAW_ASSISTANT_SQL = "SELECT raw_assistant1_json, raw_assistant2_json FROM candidates WHERE id = ?"
+_SELECT_CANDIDATES_SQL = (f"SELECT {_SELECT_CANDIDATE_COLUMNS} FROM candidates WHERE job_id = ? "
+                          "ORDER BY candidates.score_percent DESC, candidates.overall_score_percent DESC") # Sort on the stored REAL, not the cast alias
+
+def load_candidates_for_job(job_id: int) -> dict[str, list]:
+    """
+    Loads the candidate columns shown in the results table for a specific job ID (NO extraction_date).
+
+    Returns:
+        Column-oriented data: {column_name: [value per candidate, ...]}, including
+        'candidate_name' and 'email' extracted in SQL. Empty dict if there are no rows or on error.
+    """
+    if not job_id: return {}
+    try:
+        with _get_conn() as conn:
+            cursor = conn.cursor(); rows = cursor.execute(_SELECT_CANDIDATES_SQL, (job_id,)).fetchall()
+            columns = [desc[0] for desc in cursor.description]
+        if not rows: logging.info(f"Loaded 0 candidates for job ID: {job_id}."); return {}
+        # Transpose rows into columns (AoS -> SoA) so pandas wraps each list directly
+        data = {col: list(values) for col, values in zip(columns, zip(*rows))}
+        logging.info(f"Loaded {len(rows)} candidates for job ID: {job_id}."); return data
+    except sqlite3.Error as e: logging.error(f"DB load error job {job_id}: {e}", exc_info=True); return {}
+    except Exception as e: logging.error(f"Unexpected error loading job {job_id}: {e}", exc_info=True); return {}
+
+def _raw_json_text(raw: bytes | str | None) -> str | None:
+    """Stored raw assistant output as text: BLOBs are compressed, TEXT values predate compression and are returned as stored."""
+    return zlib.decompress(raw).decode("utf-8") if isinstance(raw, bytes) else raw
+
+def get_raw_assistant_json(candidate_id: int) -> tuple[str | None, str | None]:
+    """Returns a candidate's (raw assistant 1, raw assistant 2) JSON text, decompressing on demand. (None, None) on miss/error."""
     try:
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            conn.row_factory = sqlite3.Row
-            query = f"SELECT {select_cols_str} FROM candidates WHERE job_id = ? ORDER BY score_percent DESC, overall_score_percent DESC"
-            cursor = conn.cursor(); results = cursor.execute(query, (job_id,)).fetchall()
-        # ... (Data processing to extract name/email - unchanged) ...
-        data = [dict(row) for row in results]
-        for row in data:
-             try: pi=json.loads(row['personal_information']) if row.get('personal_information') else {}; row['candidate_name']=pi.get('full_name','N/A'); row['email']=pi.get('email','N/A')
-             except: row['candidate_name']='Error'; row['email']=''
-        logging.info(f"Loaded {len(data)} candidates for job ID: {job_id}."); return data
-    except sqlite3.Error as e: logging.error(f"DB load error job {job_id}: {e}", exc_info=True); return []
-    except Exception as e: logging.error(f"Unexpected error loading job {job_id}: {e}", exc_info=True); return []
\ No newline at end of file
+        with _get_conn() as conn:
+            row = conn.execute(_GET_RAW_ASSISTANT_SQL, (candidate_id,)).fetchone()
+        if not row: return None, None
+        return _raw_json_text(row[0]), _raw_json_text(row[1])
+    except (sqlite3.Error, zlib.error, UnicodeDecodeError) as e: logging.error(f"Error reading raw JSON for candidate {candidate_id}: {e}", exc_info=True); return None, None